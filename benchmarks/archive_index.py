@@ -0,0 +1,62 @@
+"""Appending pages to a CBZ archive with and without an ArchiveIndex
+
+Usage:
+    archive_index [<entries>...]
+
+Arguments:
+    <entries>  Entries appended per run, 2500, 5000 and 10000 if none
+
+Every page is checked for being archived already before it is written,
+once through `cbz.ArchiveIndex` and once by scanning `namelist()` as the
+archives did before. The archives are written to memory, so only the
+membership checks and the zip bookkeeping are timed.
+
+Run from the repository root with `python -m benchmarks.archive_index`.
+"""
+
+import io
+import time
+import zipfile
+
+import docopt as dopt
+
+from comics_crawler.comics import cbz
+
+ENTRIES = (2500, 5000, 10000)
+PAGE = b'\xff\xd8\xff\xe0' + bytes(252)
+
+
+def _page_names(entries: int):
+    return ["page_{:0>5}.jpg".format(number) for number in range(entries)]
+
+
+def with_index(entries: int) -> float:
+    started = time.perf_counter()
+    with zipfile.ZipFile(io.BytesIO(), mode='a') as zip_file:
+        index = cbz.ArchiveIndex(zip_file)
+        for name in _page_names(entries):
+            if name not in index:
+                index.writestr(name, PAGE)
+    return time.perf_counter() - started
+
+
+def with_namelist(entries: int) -> float:
+    started = time.perf_counter()
+    with zipfile.ZipFile(io.BytesIO(), mode='a') as zip_file:
+        for name in _page_names(entries):
+            if name not in zip_file.namelist():
+                zip_file.writestr(name, PAGE)
+    return time.perf_counter() - started
+
+
+def main():
+    arguments = dopt.docopt(__doc__)
+    for entries in map(int, arguments['<entries>'] or ENTRIES):
+        print("{:>6} entries  index {:>6.2f}s  namelist {:>6.2f}s".format(
+            entries,
+            with_index(entries),
+            with_namelist(entries)))
+
+
+if __name__ == '__main__':
+    main()
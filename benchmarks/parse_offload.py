@@ -0,0 +1,98 @@
+"""Event loop lag and throughput with and without offloaded parsing
+
+Usage:
+    parse_offload [--pages=N] [--in-flight=N] [--workers=N]
+
+Options:
+    --pages=N      Reader pages parsed per executor [default: 2000]
+    --in-flight=N  Pages downloaded and parsed at once [default: 500]
+    --workers=N    Workers of the thread and process pools [default: 4]
+
+Every page is downloaded by a short sleep and then parsed through
+`parse_executor.run`, like helveticascans resolves its image urls. A
+ticker meant to wake up every millisecond measures how late the event
+loop runs it, which is how late every other download would be served.
+
+Run from the repository root with `python -m benchmarks.parse_offload`.
+"""
+
+import asyncio
+import pathlib as pl
+import random
+import statistics
+import time
+
+import docopt as dopt
+
+from comics_crawler.helveticascans import uri
+from crawler_common import parse_executor
+
+FIXTURES = pl.Path(__file__).parent / 'fixtures'
+TICK = 0.001
+DOWNLOAD_SECONDS = 0.05
+
+
+async def _ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def _crawl(page: str, expected: str, pages: int, in_flight: int):
+    slots = asyncio.Semaphore(in_flight)
+
+    async def resolve():
+        async with slots:
+            await asyncio.sleep(random.uniform(0, DOWNLOAD_SECONDS))
+            image_uri = await parse_executor.run(uri.parse_image_uri, page)
+        assert image_uri == expected, image_uri
+
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.ensure_future(_ticker(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[resolve() for _ in range(pages)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return elapsed, lags
+
+
+def run(kind: str, page: str, pages: int, in_flight: int, workers: int):
+    expected = uri.parse_image_uri(page)
+    parse_executor.configure(kind, workers)
+    try:
+        # Start the pool outside the measurement
+        asyncio.run(_crawl(page, expected, workers, workers))
+        random.seed(0)
+        elapsed, lags = asyncio.run(
+            _crawl(page, expected, pages, in_flight))
+    finally:
+        parse_executor.shutdown()
+    lags.sort()
+    print("{:<7} {:>8.0f} pages/s  loop lag p50 {:>6.1f}ms  "
+          "p99 {:>6.1f}ms  max {:>6.1f}ms".format(
+              kind,
+              pages / elapsed,
+              statistics.median(lags) * 1000,
+              lags[int(len(lags) * 0.99)] * 1000,
+              lags[-1] * 1000))
+
+
+def main():
+    arguments = dopt.docopt(__doc__)
+    page = (FIXTURES / 'helveticascans_reader.html').read_text()
+    pages = int(arguments['--pages'])
+    in_flight = int(arguments['--in-flight'])
+    workers = int(arguments['--workers'])
+    print("{} pages, {} in flight, {} workers".format(
+        pages, in_flight, workers))
+    for kind in (parse_executor.EXECUTOR_INLINE,
+                 parse_executor.EXECUTOR_THREAD,
+                 parse_executor.EXECUTOR_PROCESS):
+        run(kind, page, pages, in_flight, workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Strained fast paths against the full BeautifulSoup parse
+
+Usage:
+    strained_parse [--repeat=N]
+
+Options:
+    --repeat=N  Parses per page and path [default: 200]
+
+Parses the recorded pages in `fixtures` with the strained fast path and
+with the full parse it falls back to, checks that both find the same
+and prints the time per page of each.
+
+Run from the repository root with `python -m benchmarks.strained_parse`.
+"""
+
+import pathlib as pl
+import time
+
+import docopt as dopt
+
+from comics_crawler import mangafox
+from comics_crawler.helveticascans import uri
+
+FIXTURES = pl.Path(__file__).parent / 'fixtures'
+
+CASES = (
+    ('helveticascans image uri', 'helveticascans_reader.html',
+     uri._strained_image_uri, uri._full_image_uri),
+    ('mangafox chapter page', 'mangafox_chapter.html',
+     mangafox._strained_chapter_page, mangafox._full_chapter_page),
+    ('mangafox page numbers', 'mangafox_chapter.html',
+     mangafox._strained_page_numbers, mangafox._full_page_numbers),
+)
+
+
+def _seconds_per_parse(function, page: str, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(page)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    arguments = dopt.docopt(__doc__)
+    repeat = int(arguments['--repeat'])
+    for name, fixture, strained, full in CASES:
+        page = (FIXTURES / fixture).read_text()
+        result = strained(page)
+        if result != full(page):
+            raise AssertionError("{}: {!r} != {!r}".format(
+                name, result, full(page)))
+        strained_seconds = _seconds_per_parse(strained, page, repeat)
+        full_seconds = _seconds_per_parse(full, page, repeat)
+        print("{:<26} strained {:>6.2f}ms  full {:>6.2f}ms  {:>4.1f}x".format(
+            name,
+            strained_seconds * 1000,
+            full_seconds * 1000,
+            full_seconds / strained_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,16 @@
+import asyncio
+import io
 import logging
+import os
 from os import PathLike
-import pathlib as pl
+import posixpath
+import struct
+import threading
+from typing import Any, Dict, Optional, Set
 import zipfile
+import zlib
 
+from .compression import CompressionPolicy, CompressionStats, DEFAULT_POLICY
 from .volume import Volume
 from .pages import Page
 
@@ -11,22 +19,146 @@ logger = logging.getLogger(__name__)
 ZIP_OPEN_MODE_APPEND = 'a'
 
 
+class ArchiveIndex:
+    """Membership index over the entries of one open archive
+
+    Entries are keyed on their name without the suffix, so a page is
+    only written once whatever image format it was served in. Writes
+    going through the index keep it current, which makes every
+    membership check O(1) instead of a `namelist()` scan.
+
+    Each written entry is stored or deflated as decided by `policy`,
+    the outcome is tallied in `stats`.
+    """
+
+    def __init__(
+            self,
+            zip_file: zipfile.ZipFile,
+            policy: CompressionPolicy = DEFAULT_POLICY,
+    ):
+        self.zip_file = zip_file
+        self.policy = policy
+        self.stats = CompressionStats()
+        self._stems: Set[str] = {
+            _remove_suffix(info.filename)
+            for info in zip_file.infolist()
+        }
+
+    def __contains__(self, file_name: str) -> bool:
+        return _remove_suffix(file_name) in self._stems
+
+    def __len__(self) -> int:
+        return len(self._stems)
+
+    def writestr(self, file_name: str, data: bytes) -> bool:
+        stem = _remove_suffix(file_name)
+        if stem in self._stems:
+            return False
+        self.zip_file.writestr(
+            zinfo_or_arcname=file_name,
+            data=data,
+            compress_type=self.policy.compress_type(
+                file_name,
+                data,
+                stats=self.stats))
+        self.stats.record(self.zip_file.infolist()[-1])
+        self._stems.add(stem)
+        return True
+
+
+def is_damaged(file_path: PathLike) -> bool:
+    return os.path.exists(file_path) and not zipfile.is_zipfile(file_path)
+
+
+def repair_archive(file_path: PathLike) -> int:
+    """Rebuild the central directory of an archive from its local headers
+
+    An archive that was interrupted while it was written, e.g. by a
+    crash, has all its complete entries but no central directory. The
+    entries are read one after another up to the first incomplete or
+    corrupt one and written into a new archive, which replaces the
+    damaged one. Returns the number of entries recovered.
+    """
+    repaired_path = os.fspath(file_path) + '.repair'
+    recovered = 0
+    with open(file_path, 'rb') as damaged, \
+            zipfile.ZipFile(repaired_path, mode='w') as repaired:
+        for info, data in _local_entries(damaged):
+            repaired.writestr(info, data)
+            recovered += 1
+    os.replace(repaired_path, file_path)
+    logger.warning("Repaired archive %s, recovered %d entries",
+                   file_path, recovered)
+    return recovered
+
+
+def _local_entries(f):
+    while True:
+        header = f.read(zipfile.sizeFileHeader)
+        if len(header) < zipfile.sizeFileHeader:
+            return
+        (signature, _, _, flags, compress_type, time, date, crc,
+         compress_size, _, name_size, extra_size) = struct.unpack(
+            zipfile.structFileHeader, header)
+        # Sizes in a data descriptor after the data can't be found
+        # without the central directory
+        if signature != zipfile.stringFileHeader or flags & 0x08:
+            return
+        name = f.read(name_size).decode('utf-8' if flags & 0x800 else 'cp437')
+        f.seek(extra_size, io.SEEK_CUR)
+        raw = f.read(compress_size)
+        if len(raw) < compress_size:
+            return
+        try:
+            if compress_type == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(raw, -zlib.MAX_WBITS)
+            elif compress_type == zipfile.ZIP_STORED:
+                data = raw
+            else:
+                return
+        except zlib.error:
+            return
+        if zlib.crc32(data) != crc:
+            return
+        info = zipfile.ZipInfo(name, date_time=(
+            (date >> 9) + 1980,
+            (date >> 5) & 0xF,
+            date & 0x1F,
+            time >> 11,
+            (time >> 5) & 0x3F,
+            (time & 0x1F) * 2))
+        info.compress_type = compress_type
+        yield info, data
+
+
+def open_for_append(file_path: PathLike) -> zipfile.ZipFile:
+    """Open an archive to add entries to, creating it if needed
+
+    An archive left without a central directory, e.g. by a crash while
+    it was written, is repaired first.
+    """
+    if is_damaged(file_path):
+        repair_archive(file_path)
+    return zipfile.ZipFile(
+        file_path,
+        mode=ZIP_OPEN_MODE_APPEND,
+        compression=zipfile.ZIP_DEFLATED)
+
+
 async def write_cbz(
         file_path: PathLike,
         volume: Volume,
+        policy: CompressionPolicy = DEFAULT_POLICY,
 ):
-    with zipfile.ZipFile(
-            file_path,
-            mode=ZIP_OPEN_MODE_APPEND,
-            compression=zipfile.ZIP_DEFLATED
-    ) as zip_file:
+    with open_for_append(file_path) as zip_file:
+        index = ArchiveIndex(zip_file, policy)
         if volume.cover is not None:
             logger.info(
                 "Writing Volume %s Cover",
                 volume.identifier,
             )
             await _write_page_to_file(
-                zip_file,
+                index,
                 f"cover.{await volume.cover.suffix}",
                 volume.cover,
             )
@@ -40,17 +172,24 @@ async def write_cbz(
                 number_of_pages,
             )
             await _write_page_to_file(
-                zip_file,
+                index,
                 f"page_{page.number:0>5}.{await page.suffix}",
                 page)
+        index.stats.report(f"Volume {volume.identifier}")
+
+
+def archive_path(volume: Volume):
+    return volume.generate_file_name().with_suffix('.cbz')
 
 
 def open_zipfile(
         volume: Volume,
         mode='r',
 ) -> zipfile.ZipFile:
+    if mode == ZIP_OPEN_MODE_APPEND:
+        return open_for_append(archive_path(volume))
     return zipfile.ZipFile(
-            volume.generate_file_name().with_suffix('.cbz'),
+            archive_path(volume),
             mode=mode,
             compression=zipfile.ZIP_DEFLATED)
 
@@ -67,13 +206,15 @@ def filter_pages(
 def _filter_pages(
         volume: Volume
 ):
+    if is_damaged(archive_path(volume)):
+        repair_archive(archive_path(volume))
     with open_zipfile(volume) as zf:
-        file_names = [_remove_suffix(x) for x in zf.filelist]
-        cover = volume.cover if 'cover' not in file_names else None
+        index = ArchiveIndex(zf)
+        cover = volume.cover if 'cover' not in index else None
         pages = [
             page
             for page in volume.pages
-            if f"page_{page.identifier}" not in file_names
+            if f"page_{page.identifier}" not in index
         ]
 
         return Volume(
@@ -84,34 +225,136 @@ def _filter_pages(
         )
 
 
-def _remove_suffix(file: zipfile.ZipInfo) -> str:
-    return str(pl.Path(file.filename).with_suffix(""))
+def _remove_suffix(file_name: str) -> str:
+    return posixpath.splitext(file_name)[0]
 
 
 async def _write_page_to_file(
-        zip_file: zipfile.ZipFile,
+        index: ArchiveIndex,
         file_name: str,
         page: Page):
-    if file_name not in zip_file.namelist():
-        zip_file.writestr(
-            zinfo_or_arcname=file_name,
-            data=await page.get_content())
+    if file_name not in index:
+        index.writestr(file_name, await page.get_content())
 
 
 def write_images_to_file(
         volume: Volume,
         images: list,
+        policy: CompressionPolicy = DEFAULT_POLICY,
 ):
     with open_zipfile(
             volume,
             mode=ZIP_OPEN_MODE_APPEND
     ) as zf:
+        index = ArchiveIndex(zf, policy)
         for filename, image in images:
-            _write_image_to_file(zf, filename, image)
+            _write_image_to_file(index, filename, image)
+    index.stats.report(f"Volume {volume.identifier}")
+
+
+async def write_images_from_queue(
+        volume: Volume,
+        queue: asyncio.Queue,
+        policy: CompressionPolicy = DEFAULT_POLICY,
+):
+    """Append (filename, image) pairs to the volume archive as they arrive
+
+    Consumes the queue until a `None` sentinel is received. The archive is
+    only opened once the first image arrives, so volumes waiting for their
+    downloads don't keep empty archives open. Entries are written in
+    arrival order, the central directory is sorted by file name on close
+    so the final page order doesn't depend on download timing.
+    """
+    with StreamingArchive(archive_path(volume), policy) as archive:
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    break
+                filename, image = item
+                archive.write(filename, image)
+            finally:
+                queue.task_done()
+
+
+def _sort_entries(zf: zipfile.ZipFile, key=None):
+    if key is None:
+        zf.filelist.sort(key=lambda info: info.filename)
+    else:
+        zf.filelist.sort(key=lambda info: key(info.filename))
+
+
+class StreamingArchive:
+    """Archive that downloaded images are written into as they arrive
+
+    Safe to share between threads. The file is opened when the first
+    entry is written or looked up in an existing archive, so an archive
+    nothing was written to isn't created at all. Entries are written in
+    arrival order, on close the central directory is sorted by the
+    position given to `set_position`, entries without one go last in name
+    order.
+    """
+
+    def __init__(
+            self,
+            file_path: PathLike,
+            policy: CompressionPolicy = DEFAULT_POLICY,
+    ):
+        self.file_path = file_path
+        self.policy = policy
+        self._zip_file: Optional[zipfile.ZipFile] = None
+        self._index: Optional[ArchiveIndex] = None
+        self._closed = False
+        self._positions: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _open(self) -> ArchiveIndex:
+        # Called with the lock held
+        if self._closed:
+            raise ValueError(
+                "Archive {} is already closed".format(self.file_path))
+        if self._index is None:
+            self._zip_file = open_for_append(self.file_path)
+            self._index = ArchiveIndex(self._zip_file, self.policy)
+        return self._index
+
+    def __contains__(self, file_name: str) -> bool:
+        with self._lock:
+            if self._index is None and not os.path.exists(self.file_path):
+                return False
+            return file_name in self._open()
+
+    def set_position(self, file_name: str, position):
+        with self._lock:
+            self._positions[file_name] = position
+
+    def write(self, file_name: str, data: bytes) -> bool:
+        with self._lock:
+            return self._open().writestr(file_name, data)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._zip_file is None:
+                return
+            _sort_entries(self._zip_file, self._sort_key)
+            self._zip_file.close()
+        self._index.stats.report(str(self.file_path))
+
+    def _sort_key(self, file_name: str):
+        position = self._positions.get(file_name)
+        if position is None:
+            return 1, (), file_name
+        return 0, position, file_name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
-def _write_image_to_file(zf, filename, image):
-    if filename not in zf.namelist():
-        zf.writestr(
-            zinfo_or_arcname=filename,
-            data=image)
+def _write_image_to_file(index: ArchiveIndex, filename, image):
+    index.writestr(filename, image)
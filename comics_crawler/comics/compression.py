@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field
+import logging
+import posixpath
+import time
+from typing import Dict, FrozenSet, Optional, Tuple
+import zipfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+PRECOMPRESSED_SUFFIXES = frozenset({
+    'jpg',
+    'jpeg',
+    'png',
+    'webp',
+    'gif',
+})
+
+
+@dataclass
+class CompressionStats:
+    """Per archive tally of the decisions made by a CompressionPolicy
+
+    The `estimated_*` values extrapolate a deflated sample to the stored
+    entries. Already compressed formats are sampled once per suffix, the
+    first entry's sample stands for all entries of its suffix.
+    """
+    entries_stored: int = 0
+    entries_deflated: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    estimated_bytes_forgone: float = 0.0
+    estimated_cpu_seconds_saved: float = 0.0
+    # Saving and CPU seconds per byte of the sample taken per suffix
+    samples: Dict[str, Tuple[float, float]] = field(
+        default_factory=dict,
+        repr=False)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+    def record(self, info: zipfile.ZipInfo):
+        if info.compress_type == zipfile.ZIP_STORED:
+            self.entries_stored += 1
+        else:
+            self.entries_deflated += 1
+        self.bytes_in += info.file_size
+        self.bytes_out += info.compress_size
+
+    def estimate(self, size: int, saving: float, cpu_per_byte: float):
+        """Add a stored entry of `size` bytes to the estimates"""
+        self.estimated_bytes_forgone += max(saving, 0) * size
+        self.estimated_cpu_seconds_saved += cpu_per_byte * size
+
+    def report(self, name: str):
+        logger.info(
+            "%s: %d entries stored, %d deflated, %d bytes saved by deflate, "
+            "~%.0f bytes forgone and ~%.3f CPU seconds saved by storing",
+            name,
+            self.entries_stored,
+            self.entries_deflated,
+            self.bytes_saved,
+            self.estimated_bytes_forgone,
+            self.estimated_cpu_seconds_saved,
+        )
+
+
+@dataclass(frozen=True)
+class CompressionPolicy:
+    """Choose ZIP_STORED or ZIP_DEFLATED for each archive entry
+
+    Entries with a suffix in `stored_suffixes` are already compressed
+    media and are always stored. Everything else is deflated if
+    deflating the first `sample_size` bytes saves at least `min_saving`
+    of their size. A `sample_size` of 0 deflates without sampling.
+    """
+    stored_suffixes: FrozenSet[str] = PRECOMPRESSED_SUFFIXES
+    sample_size: int = 32 * 1024
+    min_saving: float = 0.05
+
+    def compress_type(
+            self,
+            file_name: str,
+            data: bytes,
+            size: Optional[int] = None,
+            stats: Optional[CompressionStats] = None,
+    ) -> int:
+        """Pick the compression for one entry
+
+        Args:
+            file_name: Name of the entry, used for its suffix.
+            data: Content of the entry, or at least its first
+                `sample_size` bytes.
+            size: Full size of the entry. Defaults to `len(data)`.
+            stats: Updated with estimates for stored entries.
+
+        """
+        if size is None:
+            size = len(data)
+        suffix = posixpath.splitext(file_name)[1].lstrip('.').lower()
+        if suffix not in self.stored_suffixes and self.sample_size == 0:
+            return zipfile.ZIP_DEFLATED
+        if size == 0:
+            return zipfile.ZIP_STORED
+
+        if suffix in self.stored_suffixes:
+            if stats is not None:
+                sample = stats.samples.get(suffix)
+                if sample is None:
+                    sample = stats.samples[suffix] = self._sample(data)
+                stats.estimate(size, *sample)
+            return zipfile.ZIP_STORED
+
+        saving, cpu_per_byte = self._sample(data)
+        if saving >= self.min_saving:
+            return zipfile.ZIP_DEFLATED
+        if stats is not None:
+            stats.estimate(size, saving, cpu_per_byte)
+        return zipfile.ZIP_STORED
+
+    def _sample(self, data: bytes) -> Tuple[float, float]:
+        """Saving and CPU seconds per byte of deflating a sample of `data`"""
+        sample = data[:self.sample_size or None]
+        start = time.process_time()
+        saving = 1 - len(zlib.compress(sample)) / len(sample)
+        return saving, (time.process_time() - start) / len(sample)
+
+
+DEFAULT_POLICY = CompressionPolicy()
+DEFLATE_ALL = CompressionPolicy(
+    stored_suffixes=frozenset(),
+    sample_size=0,
+)
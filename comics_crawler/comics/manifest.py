@@ -0,0 +1,144 @@
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import logging
+from os import PathLike
+import pathlib as pl
+from typing import Dict, Optional
+
+from . import cbz
+from .pages import Page
+from .volume import Volume
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+@dataclass(frozen=True)
+class PageRecord:
+    file_name: str
+    # Unknown for pages adopted from an archive written without manifest
+    image_url: Optional[str] = None
+    sha256: Optional[str] = None
+
+    @classmethod
+    def from_image(cls, file_name: str, image_url: str, image: bytes):
+        return cls(
+            file_name,
+            image_url,
+            hashlib.sha256(image).hexdigest(),
+        )
+
+
+def page_key(page: Page) -> str:
+    """Archive entry name of the page without its suffix"""
+    return "cover" if page.is_cover else f"page_{page.identifier}"
+
+
+class Manifest:
+    """Sidecar index of what has been archived for one series
+
+    Maps volume identifiers to the pages written into their archive, so
+    the pages still missing can be worked out without opening any
+    archive. Volumes without a manifest entry fall back to
+    `cbz.filter_pages`.
+    """
+
+    def __init__(
+            self,
+            path: PathLike,
+            volumes: Dict[str, Dict[str, PageRecord]] = None,
+    ):
+        self.path = pl.Path(path)
+        self.volumes = volumes if volumes is not None else {}
+
+    @staticmethod
+    def path_for(series_name: str, base_path: PathLike = None) -> pl.Path:
+        if base_path is None:
+            base_path = pl.Path("./download")
+        return pl.Path(base_path) / f"{series_name}.manifest.json"
+
+    @classmethod
+    def load(cls, series_name: str, base_path: PathLike = None):
+        path = cls.path_for(series_name, base_path)
+        try:
+            with path.open() as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            return cls(path)
+        except ValueError:
+            logger.warning("Ignoring unreadable manifest %s", path)
+            return cls(path)
+        if content.get('version') != MANIFEST_VERSION:
+            logger.warning("Ignoring manifest %s of unknown version", path)
+            return cls(path)
+        return cls(path, {
+            identifier: {
+                key: PageRecord(**record)
+                for key, record in pages.items()
+            }
+            for identifier, pages in content['volumes'].items()
+        })
+
+    def save(self):
+        content = {
+            'version': MANIFEST_VERSION,
+            'volumes': {
+                identifier: {
+                    key: asdict(record)
+                    for key, record in pages.items()
+                }
+                for identifier, pages in self.volumes.items()
+            },
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix('.tmp')
+        with temporary_path.open('w') as f:
+            json.dump(content, f, separators=(',', ':'))
+        temporary_path.replace(self.path)
+
+    def filter_pages(self, volume: Volume) -> Volume:
+        """Return the volume reduced to the pages not yet archived"""
+        archived = self.volumes.get(volume.identifier)
+        if archived is None:
+            return self._adopt_archive(volume)
+        archive_path = cbz.archive_path(volume)
+        if not archive_path.is_file():
+            # The archive was removed, the manifest entry is stale
+            del self.volumes[volume.identifier]
+            return volume
+        if cbz.is_damaged(archive_path):
+            # Interrupted while pages were added, it may have lost
+            # recorded pages as well. Go by what is left after repairing.
+            del self.volumes[volume.identifier]
+            return self._adopt_archive(volume)
+
+        cover = volume.cover
+        if cover is not None and page_key(cover) in archived:
+            cover = None
+        return Volume(
+            volume.series_name,
+            volume.identifier,
+            cover,
+            [
+                page
+                for page in volume.pages
+                if page_key(page) not in archived
+            ],
+        )
+
+    def _adopt_archive(self, volume: Volume) -> Volume:
+        filtered = cbz.filter_pages(volume)
+        missing = {
+            page_key(page)
+            for page in filtered.pages + [filtered.cover]
+            if page is not None
+        }
+        for page in volume.pages + [volume.cover]:
+            if page is not None and page_key(page) not in missing:
+                self.record(volume, page, PageRecord(page_key(page)))
+        return filtered
+
+    def record(self, volume: Volume, page: Page, record: PageRecord):
+        self.volumes.setdefault(volume.identifier, {})[page_key(page)] = record
@@ -0,0 +1,171 @@
+import asyncio
+from dataclasses import dataclass
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 8
+DEFAULT_LIMIT_PER_HOST = 4
+
+
+class PrioritySemaphore:
+    """Semaphore that hands free slots to the waiter with the lowest priority
+
+    Waiters with equal priority are served in arrival order.
+    """
+
+    def __init__(self, value: int):
+        if value < 1:
+            raise ValueError("PrioritySemaphore value must be at least 1")
+        self._value = value
+        self._waiters: List[Tuple[Any, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters,
+            (priority, next(self._counter), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancellation
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._value += 1
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+
+class HostLimits:
+    """Per host slots, shared by every Scheduler given the same instance
+
+    Schedulers for stages that talk to the same hosts share one, so a
+    host never gets more than `limit_per_host` requests in flight over
+    all stages together.
+    """
+
+    def __init__(self, limit_per_host: int = DEFAULT_LIMIT_PER_HOST):
+        self.limit_per_host = limit_per_host
+        self._hosts: Dict[str, PrioritySemaphore] = {}
+
+    def semaphore(self, host: str) -> PrioritySemaphore:
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = PrioritySemaphore(self.limit_per_host)
+            self._hosts[host] = semaphore
+        return semaphore
+
+
+@dataclass
+class StageMetrics:
+    jobs: int = 0
+    failed: int = 0
+    wait_seconds: float = 0.0
+    run_seconds: float = 0.0
+    max_in_flight: int = 0
+
+    def report(self, name: str):
+        logger.info(
+            "%s: %d jobs (%d failed), %.2fs waiting for a slot, "
+            "%.2fs running, at most %d in flight",
+            name,
+            self.jobs,
+            self.failed,
+            self.wait_seconds,
+            self.run_seconds,
+            self.max_in_flight,
+        )
+
+
+class Scheduler:
+    """Run download jobs under a global and a per host concurrency limit
+
+    Jobs are started in priority order (lowest first) once a slot is free,
+    so the number of requests in flight never exceeds `limit`, no matter
+    how many jobs are submitted. The per host slots come from `hosts`,
+    which may be shared with other schedulers, a scheduler gets its own
+    if none is given. Time spent waiting for and holding a slot is
+    collected in `metrics`.
+    """
+
+    def __init__(
+            self,
+            limit: int = DEFAULT_LIMIT,
+            limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+            name: str = "scheduler",
+            hosts: Optional[HostLimits] = None,
+    ):
+        if hosts is None:
+            hosts = HostLimits(limit_per_host)
+        self.limit = limit
+        self.hosts = hosts
+        self.name = name
+        self._global = PrioritySemaphore(limit)
+        self.in_flight = 0
+        self.metrics = StageMetrics()
+
+    @property
+    def limit_per_host(self) -> int:
+        return self.hosts.limit_per_host
+
+    def report(self):
+        self.metrics.report(self.name)
+
+    async def run(
+            self,
+            priority,
+            host: str,
+            job: Callable[..., Awaitable],
+            *args,
+            **kwargs,
+    ):
+        # Take the host slot first, so jobs waiting on a busy host
+        # don't hold on to global slots other hosts could use
+        host_semaphore = self.hosts.semaphore(host)
+        queued = time.perf_counter()
+        await host_semaphore.acquire(priority)
+        try:
+            await self._global.acquire(priority)
+            started = time.perf_counter()
+            try:
+                self.in_flight += 1
+                self.metrics.max_in_flight = max(
+                    self.metrics.max_in_flight,
+                    self.in_flight)
+                logger.debug(
+                    "%s: starting job %s on %s (%d in flight)",
+                    self.name,
+                    priority,
+                    host,
+                    self.in_flight,
+                )
+                return await job(*args, **kwargs)
+            except Exception:
+                self.metrics.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self.metrics.jobs += 1
+                self.metrics.wait_seconds += started - queued
+                self.metrics.run_seconds += time.perf_counter() - started
+                self._global.release()
+        finally:
+            host_semaphore.release()
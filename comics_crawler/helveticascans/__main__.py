@@ -2,10 +2,11 @@ import argparse
 import asyncio
 import pathlib as pl
 
-from .uri import get_page_list, init_session, close_session
+from .uri import get_page_list, open_session
 from .pages import uris_to_pages
 from .volume import group_volumes
 from .series import download_series
+from crawler_common import parse_executor
 
 kyuu_chan_base_url = "https://helveticascans.com/r/series/wonder-cat-kyuu-chan/"
 
@@ -36,9 +37,9 @@ async def main_():
 
 
 async def main():
-    init_session(asyncio.get_running_loop())
-    await download_series("wonder-cat-kyuu-chan")
-    close_session()
+    async with open_session():
+        await download_series("wonder-cat-kyuu-chan")
+    parse_executor.shutdown()
 
 
 if __name__ == '__main__':
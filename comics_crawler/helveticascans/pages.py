@@ -4,6 +4,7 @@ from bs4 import BeautifulSoup
 from .uri import pattern, get_image_uri, get_image, HTML_PARSER, retrieve_series_page
 
 from comics_crawler.comics.pages import Page as GeneralPage
+from crawler_common import parse_executor
 
 
 class Page:
@@ -73,7 +74,7 @@ async def uris_to_pages(pages_list):
 
 async def retrieve_pages_of_series(series_name: str):
     page = await retrieve_series_page(series_name)
-    return parse_series_page(await page.text())
+    return await parse_executor.run(parse_series_page, page)
 
 
 def parse_series_page(page: str):
@@ -2,29 +2,57 @@ import asyncio
 
 from .uri import retrieve_series_page
 from .pages import parse_series_page
-from .volume import group_volumes, download_volume
-from comics_crawler.comics.cbz import filter_pages
+from .volume import group_volumes, download_volume, DownloadStages
+from comics_crawler.comics.manifest import Manifest
 from comics_crawler.comics.pages import Page
+from comics_crawler.comics.scheduler import (
+    HostLimits,
+    Scheduler,
+    DEFAULT_LIMIT,
+    DEFAULT_LIMIT_PER_HOST,
+)
+from crawler_common import parse_executor
 
 
-async def download_series(series_name: str):
+async def download_series(
+        series_name: str,
+        resolve_limit: int = DEFAULT_LIMIT,
+        fetch_limit: int = DEFAULT_LIMIT,
+        limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+):
     # Download series page
     series_page = await retrieve_series_page(series_name)
     ungrouped_pages = sorted(
-        parse_series_page(await series_page.text()),
+        await parse_executor.run(parse_series_page, series_page),
         key=to_sortable,
     )
     volumes = group_volumes(
         series_name,
         ungrouped_pages.__iter__())
+    manifest = Manifest.load(series_name)
     filtered_volumes = [
-        filter_pages(volume)
+        manifest.filter_pages(volume)
         for volume in volumes
     ]
+    filtered_volumes = [
+        volume
+        for volume in filtered_volumes
+        if volume.cover is not None or volume.pages
+    ]
+    # Persists pages adopted from archives written without a manifest
+    manifest.save()
 
+    # Reader pages and images may come from the same host, the per host
+    # limit holds for both stages together
+    hosts = HostLimits(limit_per_host)
+    stages = DownloadStages(
+        resolve=Scheduler(resolve_limit, name="resolve", hosts=hosts),
+        fetch=Scheduler(fetch_limit, name="fetch", hosts=hosts),
+    )
     await asyncio.gather(*[
-        download_volume(x)
+        download_volume(x, stages, manifest)
         for x in filtered_volumes])
+    stages.report()
 
 
 def to_sortable(page: Page):
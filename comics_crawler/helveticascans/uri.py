@@ -1,3 +1,5 @@
+import asyncio
+import contextlib
 import re
 
 import aiohttp
@@ -6,21 +8,58 @@ from aiohttp.typedefs import StrOrURL
 from yarl import URL
 from bs4 import BeautifulSoup, element
 
+from comics_crawler.comics.scheduler import (
+    DEFAULT_LIMIT,
+    DEFAULT_LIMIT_PER_HOST,
+)
+from crawler_common import extract, http_cache, parse_executor, retry
+
 HTML_PARSER = 'html.parser'
 SERIES_BASE_URL = URL("https://helveticascans.com/r/series/")
 
 pattern = re.compile(r"en/0/(\d+)/(\d+)?")
 
-session: aiohttp.ClientSession = None
-
+# Room for both the resolve and the fetch stage
+DEFAULT_POOL_SIZE = 2 * DEFAULT_LIMIT
+DEFAULT_POOL_SIZE_PER_HOST = 2 * DEFAULT_LIMIT_PER_HOST
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+DEFAULT_DNS_CACHE_TTL = 5 * 60
 
-def init_session(loop):
+session: aiohttp.ClientSession = None
+retry_policy = retry.RetryPolicy(
+    exceptions=(ClientConnectionError, asyncio.TimeoutError))
+
+
+@contextlib.asynccontextmanager
+async def open_session(
+        pool_size: int = DEFAULT_POOL_SIZE,
+        pool_size_per_host: int = DEFAULT_POOL_SIZE_PER_HOST,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl: int = DEFAULT_DNS_CACHE_TTL,
+):
+    """Open the session shared by all requests of this package
+
+    Connections are pooled and kept alive between requests, host names
+    are resolved through aiodns and cached. The session is closed, and
+    all its connections with it, when the context is left.
+    """
     global session
-    session = aiohttp.ClientSession(loop=loop)
-
-
-def close_session():
-    session.close()
+    if session is not None:
+        raise RuntimeError("helveticascans session is already open")
+    connector = aiohttp.TCPConnector(
+        limit=pool_size,
+        limit_per_host=pool_size_per_host,
+        keepalive_timeout=keepalive_timeout,
+        use_dns_cache=True,
+        ttl_dns_cache=dns_cache_ttl,
+        resolver=aiohttp.AsyncResolver(),
+    )
+    session = aiohttp.ClientSession(connector=connector)
+    try:
+        yield session
+    finally:
+        await session.close()
+        session = None
 
 
 def parse_page_link(link: str):
@@ -31,24 +70,27 @@ def parse_page_links(links: list):
     return [(item['href'], parse_page_link(item['href']).groups()) for item in links]
 
 
-async def retrieve_series_page(series_name: str):
+async def retrieve_series_page(series_name: str) -> str:
     series_uri = SERIES_BASE_URL / series_name
-    response = await try_get(series_uri)
+    response = await try_get_cached(series_uri)
     response.raise_for_status()
-    return response
+    return response.text
+
+
+async def try_get(uri) -> aiohttp.ClientResponse:
+    return await retry_policy.acall(uri, session.get, uri)
 
 
-async def try_get(uri, retry_count=3):
-    for _ in range(retry_count):
-        try:
-            return await session.get(uri)
-        except ClientConnectionError:
-            pass
+async def try_get_cached(uri) -> http_cache.CachedResponse:
+    return await retry_policy.acall(uri, http_cache.aget, session, uri)
 
 
 async def get_image_uri(page_uri):
-    response = await try_get(page_uri)
-    bs = BeautifulSoup(await response.text(), 'html.parser')
+    response = await try_get_cached(page_uri)
+    return await parse_executor.run(parse_image_uri, response.text)
+
+
+def _find_image_uri(bs: BeautifulSoup) -> str:
     image: element.Tag = (
         bs
         .find("div", class_="inner")
@@ -57,25 +99,41 @@ async def get_image_uri(page_uri):
     return image['src']
 
 
+def _strained_image_uri(page: str) -> str:
+    return _find_image_uri(extract.strained_soup(page, "div", class_="inner"))
+
+
+def _full_image_uri(page: str) -> str:
+    return _find_image_uri(BeautifulSoup(page, HTML_PARSER))
+
+
+parse_image_uri = extract.Extractor(_strained_image_uri, _full_image_uri)
+
+
 async def get_image(image_uri: StrOrURL) -> bytes:
     response = await try_get(image_uri)
-    response.raise_for_status()
-    return await response.read()
+    async with response:
+        response.raise_for_status()
+        return await response.read()
 
 
 def get_suffix(image_url: str):
     return image_url.split('.')[-1]
 
 
-
 async def get_page_list(series_url: StrOrURL):
-    response = await try_get(series_url)
-    page = BeautifulSoup(await response.text(), HTML_PARSER)
+    response = await try_get_cached(series_url)
+    return await parse_executor.run(parse_page_list, response.text)
+
+
+def parse_page_list(page: str):
+    page = BeautifulSoup(page, HTML_PARSER)
     comics = [
         div.find('a')
         for div in page.find("div", class_="group").find_all("div", class_="title")]
+    # Plain attribute dicts, tags can't be sent back from a process pool
     comics = [
-        x
+        dict(x.attrs)
         for x in comics
         if x is not None
     ]
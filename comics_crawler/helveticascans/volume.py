@@ -1,10 +1,16 @@
 import asyncio
+from dataclasses import dataclass
 import itertools
 from typing import Iterator, List, Optional, Iterable
 
+from yarl import URL
+
 from .uri import get_image_uri, get_image, get_suffix
 from comics_crawler.comics import Volume, Page
 from comics_crawler.comics import cbz
+from comics_crawler.comics.compression import CompressionPolicy, DEFAULT_POLICY
+from comics_crawler.comics.manifest import Manifest, PageRecord
+from comics_crawler.comics.scheduler import Scheduler
 
 # class Volume:
 #     def __init__(self, number):
@@ -103,26 +109,112 @@ def _from_iterator(
     )
 
 
-async def download_volume(volume: Volume):
+@dataclass(frozen=True)
+class DownloadStages:
+    """Schedulers of the two stages a page download goes through
+
+    `resolve` fetches and parses the reader page to find the image url,
+    `fetch` downloads the image. Each stage has its own global slots, so
+    slow reader pages don't hold up image downloads and vice versa. The
+    per host slots should be shared through `HostLimits`.
+    """
+    resolve: Scheduler
+    fetch: Scheduler
+
+    def report(self):
+        self.resolve.report()
+        self.fetch.report()
+
+
+async def download_volume(
+        volume: Volume,
+        stages: DownloadStages,
+        manifest: Manifest,
+        policy: CompressionPolicy = DEFAULT_POLICY,
+):
     print(f"Downloading volume: {volume}")
-    images = []
-    if volume.cover is not None:
-        images.append(await download_page(volume.cover))
-    for pair in await asyncio.gather(*[
-            download_page(page)
-            for page in volume.pages]):
-        images.append(pair)
+    # Bounded so finished pages wait in memory only as long as the
+    # writer needs to catch up
+    queue = asyncio.Queue(maxsize=stages.fetch.limit)
+    pages = ([volume.cover] if volume.cover is not None else []) + volume.pages
 
-    cbz.write_images_to_file(volume, images)
+    async def produce():
+        try:
+            # A failing page doesn't stop the others, the ones that made
+            # it are recorded below either way
+            return await asyncio.gather(
+                *[_queue_page(volume, page, stages, queue) for page in pages],
+                return_exceptions=True)
+        finally:
+            await queue.put(None)
 
+    _, records = await asyncio.gather(
+        cbz.write_images_from_queue(volume, queue, policy),
+        produce(),
+    )
+    # Only record pages once the archive is closed and they are on disk
+    errors = []
+    for page, record in zip(pages, records):
+        if isinstance(record, BaseException):
+            errors.append(record)
+        else:
+            manifest.record(volume, page, record)
+    manifest.save()
+    if errors:
+        raise errors[0]
 
-async def download_page(page: Page):
-    image_url = await get_image_uri(page.url)
-    image = await get_image(image_url)
+
+async def _queue_page(
+        volume: Volume,
+        page: Page,
+        stages: DownloadStages,
+        queue: asyncio.Queue,
+) -> PageRecord:
+    filename, image, image_url = await download_page(
+        volume, page, stages, queue)
+    return PageRecord.from_image(filename, image_url, image)
+
+
+def page_priority(volume: Volume, page: Page):
+    # Covers first, then volumes and pages in reading order
+    return not page.is_cover, volume.identifier, page.identifier
+
+
+async def download_page(
+        volume: Volume,
+        page: Page,
+        stages: DownloadStages,
+        queue: asyncio.Queue,
+):
+    priority = page_priority(volume, page)
+    image_url = await stages.resolve.run(
+        priority,
+        URL(page.url).host,
+        get_image_uri,
+        page.url)
     filename = (
         f"page_{page.identifier}.{get_suffix(image_url)}"
         if not page.is_cover
         else f"cover.{get_suffix(image_url)}"
     )
+    image = await stages.fetch.run(
+        priority,
+        URL(image_url).host,
+        _fetch_into_queue,
+        image_url,
+        filename,
+        queue)
     print(filename)
-    return filename, image
+    return filename, image, image_url
+
+
+async def _fetch_into_queue(
+        image_url: str,
+        filename: str,
+        queue: asyncio.Queue,
+) -> bytes:
+    image = await get_image(image_url)
+    # Queued before the fetch slot is released, so a writer that falls
+    # behind holds up further downloads instead of them piling up
+    await queue.put((filename, image))
+    return image
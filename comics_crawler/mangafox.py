@@ -9,22 +9,46 @@
 """mangafox fetches images from mangafox.me
 
 Usage:
-    mangafox [--folder=FOLDER] [--chapter] <manga_url> [<number>]
+    mangafox [--folder=FOLDER] [--chapter] [--stream] [--async]
+             [--concurrency=N] <manga_url> [<number>]
 
 Options:
     -c --chapter    Create zipfile from each chapter instead of every volume
     -f --folder=FOLDER
+    -s --stream     Write images straight into the zipfiles instead of
+                    downloading them to FOLDER first
+    -a --async      Download with the asyncio engine, one event loop and one
+                    connection pool for the whole manga
+    -n --concurrency=N  Number of requests in flight with --async [default: 6]
 
 """
 
+import aiohttp
+import asyncio
 import bs4
+import concurrent.futures
+import contextlib
 import docopt as dopt
 import functools
+import itertools
 import multiprocessing as mp
 import pathlib
 import requests
+import threading
 import zipfile
 
+from comics_crawler.comics import cbz, compression
+from crawler_common import extract, http_cache, parse_executor, retry
+
+CHUNK_SIZE = 64 * 1024
+
+async_retry_policy = retry.RetryPolicy(
+    exceptions=(
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+    ))
+
 
 def get_chapters_list(url):
     """Parse main page and  return list of volumes
@@ -37,10 +61,20 @@ def get_chapters_list(url):
               Each contains a list of chapters sorted from oldest to newest.
 
     """
-    # Download content and parse as html
-    main_page = requests.get(url)
-    main_page.encoding = 'utf-8'
-    main_page = bs4.BeautifulSoup(main_page.text)
+    return parse_chapters_list(fetch_page(url))
+
+
+def parse_chapters_list(page):
+    """Parse main page and return list of volumes
+
+    Args:
+        page (string): Html of the manga main page
+
+    Returns:
+        list: See get_chapters_list
+
+    """
+    main_page = bs4.BeautifulSoup(page)
 
     # Compile all available volumes into one list
     volume_list = main_page.findAll('ul', 'chlist')
@@ -57,36 +91,163 @@ def get_chapters_list(url):
     return chapters_list
 
 
-def crawl_chapter(chapter_url):
+def _find_chapter_page(data):
+    next_link = data.find('a', 'btn next_page')['href']
+    image = data.find('img')
+    return (image['src'] if image is not None else None), next_link
+
+
+def _strained_chapter_page(page):
+    return _find_chapter_page(extract.strained_soup(page, ['a', 'img']))
+
+
+def _full_chapter_page(page):
+    return _find_chapter_page(bs4.BeautifulSoup(page))
+
+
+parse_chapter_page = extract.Extractor(_strained_chapter_page,
+                                       _full_chapter_page)
+
+
+def _find_page_numbers(data):
+    select = data.find('select', 'm')
+    if select is None:
+        return None
+    numbers = {
+        int(option['value'])
+        for option in select.find_all('option')
+        if option.get('value', '').isdigit()
+    }
+    # Option 0 links to the comments
+    numbers.discard(0)
+    return sorted(numbers) or None
+
+
+def _strained_page_numbers(page):
+    return _find_page_numbers(extract.strained_soup(page, 'select', 'm'))
+
+
+def _full_page_numbers(page):
+    return _find_page_numbers(bs4.BeautifulSoup(page))
+
+
+parse_page_numbers = extract.Extractor(_strained_page_numbers,
+                                       _full_page_numbers)
+
+
+def fetch_page(url):
+    """Download a html page through the cache
+
+    Args:
+        url (string): Url to the page.
+
+    Returns:
+        string: Content of the page.
+
+    """
+    data = retry.DEFAULT_POLICY.call(url, http_cache.get, url)
+    data.encoding = 'utf-8'
+    return data.text
+
+
+def get_chapter_page(url):
+    """Download and parse a chapter page
+
+    Args:
+        url (string): Url to the page.
+
+    Returns:
+        tuple: Url of the image, None if there is none, and the link to
+            the next page.
+
+    """
+    return parse_chapter_page(fetch_page(url))
+
+
+def chapter_page_urls(chapter_url, first_page):
+    """Urls of all but the first page of a chapter
+
+    Args:
+        chapter_url (string): Url to the first page of the chapter.
+        first_page (string): Html of the first page.
+
+    Returns:
+        list: Urls of the following pages in reading order, None if they
+            can't be worked out from the page selector.
+
+    """
+    base_url, _, first_name = chapter_url.rpartition('/')
+    if first_name != '1.html':
+        return None
+    numbers = parse_page_numbers(first_page)
+    if numbers is None:
+        return None
+    return [
+        '{}/{}.html'.format(base_url, number)
+        for number in numbers
+        if number != 1
+    ]
+
+
+def walk_chapter(chapter_url, image, next_link):
+    """Follow the next page links of a chapter one page at a time
+
+    Args:
+        chapter_url (string): Url to the first page of the chapter.
+        image (string): Image url of the first page.
+        next_link (string): Next page link of the first page.
+
+    Returns:
+        Iterator: Over the image urls.
+
+    """
+    base_url = chapter_url.split('/')[:-1]
+    while image is not None:
+        yield image
+        if 'http' in next_link:
+            # Links to the next chapter
+            break
+        image, next_link = get_chapter_page('/'.join(base_url + [next_link]))
+
+
+def crawl_chapter(chapter_url, threads=6, executor=None):
     """Crawl chapter and yield image links
 
+    All pages listed in the page selector of the first page are fetched
+    concurrently. If there is no usable selector the chapter is walked
+    page by page.
+
     Args:
         chapter_url (string); Url to the first page of the chapter.
+        threads (int): Number of pages fetched at once. Defaults to 6.
+        executor (concurrent.futures.Executor): Fetch the pages with this
+            executor instead of starting a new one with `threads` workers.
 
     Returns:
         Iterator: Over the image urls.
 
     """
-    base_url = chapter_url.split('/')
-    del base_url[len(base_url) - 1]
-    data = requests.get(chapter_url)
-    data.encoding = 'utf-8'
-    data = bs4.BeautifulSoup(data.text)
-    image_links = list()
-    next_link = data.find('a', 'btn next_page')['href']
-    while 'http' not in next_link:
-        try:
-            image_links.append([data.find('img')['src']])
-        except TypeError:
-            break
-        data = requests.get('/'.join(base_url + [next_link]))
-        data.encoding = 'utf-8'
-        data = bs4.BeautifulSoup(data.text)
-        next_link = data.find('a', 'btn next_page')['href']
-        try:
-            yield data.find('img')['src']
-        except TypeError:
+    first_page = fetch_page(chapter_url)
+    image, next_link = parse_chapter_page(first_page)
+    page_urls = chapter_page_urls(chapter_url, first_page)
+    if page_urls is None:
+        yield from walk_chapter(chapter_url, image, next_link)
+        return
+    if image is None:
+        return
+    yield image
+    if executor is not None:
+        yield from _images_in_order(executor, page_urls)
+        return
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        yield from _images_in_order(executor, page_urls)
+
+
+def _images_in_order(executor, page_urls):
+    for image, _ in executor.map(get_chapter_page, page_urls):
+        if image is None:
             break
+        yield image
 
 
 def download_image(image, volume, chapter, folder):
@@ -102,149 +263,561 @@ def download_image(image, volume, chapter, folder):
         pathlib.Path: File_name
 
     """
-    file_path = folder / '{:03}_{:03}_{}'.format(
-        volume,
-        chapter,
-        image.split('/')[-1])
+    file_path = image_file_path(image, volume, chapter, folder)
     if file_path.exists():
         return file_path
-    r = requests.get(image, stream=True)
+    r = retry.DEFAULT_POLICY.call(image, requests.get, image, stream=True)
     with file_path.open(mode='wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
             if chunk:  # filter out keep-alive new chunks
                 f.write(chunk)
-                f.flush()
     return file_path
 
 
-def download_images(folder, images_iter, volume_idx, chapter_idx, threads=6):
-    """Download images from one iterator
+def fetch_image(image):
+    """Download a image into memory
 
     Args:
-        images_iter (iterator): Iterator over image urls
-        volume (int): Number of the volume. Only used for file naming.
-        chapter (int): Number of the chapter within the volume. Only used for
-            file naming.
-        threads (int): Number of threads used for downloading. Defaults to 6.
+        image (string): Url to the image.
 
+    Returns:
+        bytes: Content of the image
 
     """
-    download = functools.partial(download_image,
-                                 volume=volume_idx,
-                                 chapter=chapter_idx,
-                                 folder=folder)
-    if not folder.exists():
-        folder.mkdir(parents=True)
-    filenames = []
-    with mp.Pool(processes=threads) as pool:
-        for name in pool.imap(download,
-                              images_iter):
-            filenames.append(name)
-    return filenames
+    r = retry.DEFAULT_POLICY.call(image, requests.get, image)
+    r.raise_for_status()
+    return r.content
+
+
+def image_file_path(image, volume, chapter, folder):
+    return folder / '{:03}_{:03}_{}'.format(
+        volume,
+        chapter,
+        image.split('/')[-1])
+
 
+def zip_file_name(url, volume_idx, chapter_idx):
+    return '{name}_{volume:03}_{chapter:03}.cbz'.format(
+        name=url.split('/')[-2],
+        volume=volume_idx + 1,
+        chapter=chapter_idx + 1)
 
-def download_volume(url, number, folder, zip_chapter=False):
+
+def download_volume(url, number, folder, zip_chapter=False, threads=6,
+                    stream=False):
     """Process url and download specified volume
 
     Args:
         url (string): Url to the manga
         number (int): Zero-based index to the volume to download
+        threads (int): Number of workers. Defaults to 6.
+        stream (bool): Write images straight into the zip files.
 
     """
     chapters_links = get_chapters_list(url)[number]
+    download_volumes(url, folder, [(number, chapters_links)], zip_chapter,
+                     threads, stream)
 
-    volume_filenames = list()
-    for chapter_idx, chapter in enumerate(chapters_links):
-        print("Downloading chapter {:03} of {:03}".format(chapter_idx + 1,
-                                                          len(chapters_links)))
-        images_iter = crawl_chapter(chapter)
-        chapter_filenames = download_images(folder,
-                                            images_iter,
-                                            number,
-                                            chapter_idx)
-        volume_filenames.extend(chapter_filenames)
-        if zip_chapter:
-            create_zip_file(
-                '{name}_{volume:03}_{chapter:03}.cbz'.format(
-                    name=url.split('/')[-2],
-                    volume=number + 1,
-                    chapter=chapter_idx + 1),
-                chapter_filenames)
-    if not zip_chapter:
-        create_zip_file(
-            '{name}_{volume:03}_{chapter:03}.cbz'.format(
-                name=url.split('/')[-2],
-                volume=number + 1,
-                chapter=chapter_idx + 1),
-            volume_filenames)
-
-
-def download_complete_manga(url, folder, zip_chapter=False):
+
+def download_complete_manga(url, folder, zip_chapter=False, threads=6,
+                            stream=False):
     """Process url and download all volumes/chapters
 
     Args:
         url (string): Url to the manga
+        threads (int): Number of workers. Defaults to 6.
+        stream (bool): Write images straight into the zip files.
 
     """
     chapters_list = get_chapters_list(url)
-    print("Iterating over chapters_list")
-    for volume_idx, volume in enumerate(chapters_list):
-        print("Downloading volume {:03} of {:03}".format(volume_idx + 1,
-                                                         len(chapters_list)))
-        volume_filenames = list()
-        for chapter_idx, chapter in enumerate(volume):
-            print("Downloading chapter {:03} of {:03}".format(chapter_idx + 1,
-                                                              len(volume)))
-            images_iter = crawl_chapter(chapter)
-            chapter_filenames = download_images(folder,
-                                                images_iter,
-                                                volume_idx,
-                                                chapter_idx)
-            volume_filenames.extend(chapter_filenames)
-            if zip_chapter:
+    download_volumes(url, folder, list(enumerate(chapters_list)), zip_chapter,
+                     threads, stream)
+
+
+def _submit(pool, function, *args):
+    """Run function in a multiprocessing pool, return a Future of the result"""
+    future = concurrent.futures.Future()
+    pool.apply_async(function,
+                     args,
+                     callback=future.set_result,
+                     error_callback=future.set_exception)
+    return future
+
+
+def download_volumes(url, folder, volumes, zip_chapter=False, threads=6,
+                     stream=False):
+    """Download chapters of several volumes with one set of workers
+
+    All chapters are crawled concurrently and their images go into one
+    shared worker pool, so there is no pause at chapter or volume
+    boundaries. Each zip file is created as soon as its chapters are
+    complete.
+
+    Args:
+        url (string): Url to the manga
+        folder (pathlib.Path): Folder the images are downloaded to
+        volumes (list): Pairs of the zero-based volume index and the list
+            of chapter urls of the volume
+        zip_chapter (bool): Create a zip file per chapter instead of per
+            volume
+        threads (int): Number of image download processes, chapter
+            crawlers and page fetching threads. Defaults to 6.
+        stream (bool): Write the images straight into the zip files
+            instead of into folder. Defaults to False.
+
+    """
+    if not stream and not folder.exists():
+        folder.mkdir(parents=True)
+    volumes = [(idx, chapters) for idx, chapters in volumes if chapters]
+    archives = _Archives(url, volumes, zip_chapter)
+
+    # Archives are closed last, after every worker writing to them is done
+    with archives, \
+            mp.Pool(processes=threads) as pool, \
+            concurrent.futures.ThreadPoolExecutor(threads) as pages, \
+            concurrent.futures.ThreadPoolExecutor(threads) as crawlers:
+
+        def stream_chapter(volume_idx, chapter_idx, chapter):
+            archive = archives.get(volume_idx, chapter_idx)
+            names = []
+            # Written as soon as they are downloaded, in any order, the
+            # positions put them back in reading order on close
+            downloading = {}
+
+            def write(future):
+                archive.write(downloading.pop(future), future.result())
+
+            crawled = crawl_chapter(chapter, executor=pages)
+            for page_idx, image in enumerate(crawled):
+                name = image_file_path(image,
+                                       volume_idx,
+                                       chapter_idx,
+                                       pathlib.Path()).name
+                archive.set_position(name, (chapter_idx, page_idx))
+                if name not in archive:
+                    names.append(name)
+                    downloading[_submit(pool, fetch_image, image)] = name
+                for future in [x for x in downloading if x.done()]:
+                    write(future)
+            for future in concurrent.futures.as_completed(list(downloading)):
+                write(future)
+            return names
+
+        def download_chapter(volume_idx, chapter_idx, chapter):
+            if stream:
+                return stream_chapter(volume_idx, chapter_idx, chapter)
+            download = functools.partial(download_image,
+                                         volume=volume_idx,
+                                         chapter=chapter_idx,
+                                         folder=folder)
+            images = [
+                _submit(pool, download, image)
+                for image in crawl_chapter(chapter, executor=pages)
+            ]
+            return [image.result() for image in images]
+
+        jobs = {
+            crawlers.submit(download_chapter,
+                            volume_idx,
+                            chapter_idx,
+                            chapter): (volume_idx, chapter_idx)
+            for volume_idx, chapters in volumes
+            for chapter_idx, chapter in enumerate(chapters)
+        }
+        filenames = {
+            volume_idx: [None] * len(chapters)
+            for volume_idx, chapters in volumes
+        }
+        remaining = {
+            volume_idx: len(chapters)
+            for volume_idx, chapters in volumes
+        }
+        for job in concurrent.futures.as_completed(jobs):
+            volume_idx, chapter_idx = jobs[job]
+            chapter_filenames = job.result()
+            filenames[volume_idx][chapter_idx] = chapter_filenames
+            remaining[volume_idx] -= 1
+            print("Downloaded volume {:03} chapter {:03}, "
+                  "{} chapters left in volume".format(volume_idx + 1,
+                                                      chapter_idx + 1,
+                                                      remaining[volume_idx]))
+            if stream:
+                if zip_chapter or remaining[volume_idx] == 0:
+                    archives.close(volume_idx, chapter_idx)
+            elif zip_chapter:
+                create_zip_file(zip_file_name(url, volume_idx, chapter_idx),
+                                chapter_filenames)
+            elif remaining[volume_idx] == 0:
                 create_zip_file(
-                    '{name}_{volume:03}_{chapter:03}.cbz'.format(
-                        name=url.split('/')[-2],
-                        volume=volume_idx + 1,
-                        chapter=chapter_idx + 1),
-                    chapter_filenames)
-        if not zip_chapter:
-            create_zip_file(
-                '{name}_{volume:03}_{chapter:03}.cbz'.format(
-                    name=url.split('/')[-2],
-                    volume=volume_idx + 1,
-                    chapter=chapter_idx + 1),
-                volume_filenames)
-
-
-def create_zip_file(zipname, filenames):
+                    zip_file_name(url,
+                                  volume_idx,
+                                  len(filenames[volume_idx]) - 1),
+                    list(itertools.chain.from_iterable(
+                        filenames.pop(volume_idx))))
+
+
+class _Archives:
+    """Streaming archives of a download, opened on first use
+
+    Keyed by volume, or by volume and chapter with zip_chapter. Archives
+    still open on exit are closed, so their central directory is written
+    even if the download failed.
+    """
+
+    def __init__(self, url, volumes, zip_chapter):
+        self.url = url
+        self.last_chapter = {
+            volume_idx: len(chapters) - 1
+            for volume_idx, chapters in volumes
+        }
+        self.zip_chapter = zip_chapter
+        self.archives = {}
+        self.lock = threading.Lock()
+
+    def _key(self, volume_idx, chapter_idx):
+        return (volume_idx, chapter_idx) if self.zip_chapter else volume_idx
+
+    def get(self, volume_idx, chapter_idx):
+        key = self._key(volume_idx, chapter_idx)
+        with self.lock:
+            if key not in self.archives:
+                if not self.zip_chapter:
+                    chapter_idx = self.last_chapter[volume_idx]
+                self.archives[key] = cbz.StreamingArchive(
+                    zip_file_name(self.url, volume_idx, chapter_idx))
+            return self.archives[key]
+
+    def close(self, volume_idx, chapter_idx):
+        with self.lock:
+            archive = self.archives.pop(self._key(volume_idx, chapter_idx),
+                                        None)
+        if archive is not None:
+            archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            archives = list(self.archives.values())
+            self.archives.clear()
+        for archive in archives:
+            archive.close()
+
+
+def create_zip_file(zipname, filenames, policy=compression.DEFAULT_POLICY):
     """Create zip file from files in filenames list
 
     Args:
         zipname (string): Name of the zipfile to create
         filenames (list): List of files to add to the newly created zipfile
+        policy (CompressionPolicy): Decides per file whether it is stored
+            or deflated. Defaults to storing already compressed images.
+
+    Returns:
+        CompressionStats: What the policy decided for the files
 
     """
+    stats = compression.CompressionStats()
     with zipfile.ZipFile(zipname,
                          mode='w',
                          compression=zipfile.ZIP_DEFLATED) as cbz:
 
         for filename in filenames:
-            cbz.write(str(filename))
+            file_path = pathlib.Path(filename)
+            with file_path.open('rb') as f:
+                sample = f.read(policy.sample_size or -1)
+            compress_type = policy.compress_type(file_path.name,
+                                                 sample,
+                                                 file_path.stat().st_size,
+                                                 stats)
+            cbz.write(str(filename), compress_type=compress_type)
+            stats.record(cbz.infolist()[-1])
+    print("{}: {} stored, {} deflated, {} bytes saved, "
+          "~{:.3f} CPU seconds saved".format(
+              zipname,
+              stats.entries_stored,
+              stats.entries_deflated,
+              stats.bytes_saved,
+              stats.estimated_cpu_seconds_saved))
+    return stats
+
+
+async def fetch_page_async(session, url):
+    """Download a html page through the cache
+
+    Args:
+        session (aiohttp.ClientSession): Session used for the request.
+        url (string): Url to the page.
+
+    Returns:
+        string: Content of the page.
+
+    """
+    response = await async_retry_policy.acall(url,
+                                              http_cache.aget,
+                                              session,
+                                              url)
+    response.raise_for_status()
+    response.encoding = 'utf-8'
+    return response.text
+
+
+async def get_chapter_page_async(session, semaphore, url):
+    """Async version of get_chapter_page"""
+    async with semaphore:
+        page = await fetch_page_async(session, url)
+    return await parse_executor.run(parse_chapter_page, page)
+
+
+async def walk_chapter_async(session, semaphore, chapter_url, image,
+                             next_link):
+    """Async version of walk_chapter"""
+    base_url = chapter_url.split('/')[:-1]
+    while image is not None:
+        yield image
+        if 'http' in next_link:
+            break
+        image, next_link = await get_chapter_page_async(
+            session,
+            semaphore,
+            '/'.join(base_url + [next_link]))
+
+
+async def crawl_chapter_async(session, semaphore, chapter_url):
+    """Async version of crawl_chapter
+
+    Yields image urls in reading order as soon as they are discovered.
+
+    """
+    async with semaphore:
+        first_page = await fetch_page_async(session, chapter_url)
+    image, next_link = await parse_executor.run(parse_chapter_page,
+                                                first_page)
+    page_urls = await parse_executor.run(chapter_page_urls,
+                                         chapter_url,
+                                         first_page)
+    if page_urls is None:
+        async for image in walk_chapter_async(session,
+                                              semaphore,
+                                              chapter_url,
+                                              image,
+                                              next_link):
+            yield image
+        return
+    if image is None:
+        return
+    yield image
+    pages = [
+        asyncio.ensure_future(
+            get_chapter_page_async(session, semaphore, page_url))
+        for page_url in page_urls
+    ]
+    try:
+        for page in pages:
+            image, _ = await page
+            if image is None:
+                break
+            yield image
+    finally:
+        for page in pages:
+            page.cancel()
+
+
+async def download_image_async(session, semaphore, image, volume, chapter,
+                               folder):
+    """Async version of download_image"""
+    file_path = image_file_path(image, volume, chapter, folder)
+    if file_path.exists():
+        return file_path
+    async with semaphore:
+        response = await async_retry_policy.acall(image, session.get, image)
+        async with response:
+            response.raise_for_status()
+            with file_path.open(mode='wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+    return file_path
+
+
+async def stream_image_async(session, semaphore, image, name, archive):
+    """Download a image straight into an archive"""
+    async with semaphore:
+        response = await async_retry_policy.acall(image, session.get, image)
+        async with response:
+            response.raise_for_status()
+            content = await response.read()
+    archive.write(name, content)
+    return name
+
+
+async def download_chapter_async(session, semaphore, chapter_url, volume_idx,
+                                 chapter_idx, folder, archive=None):
+    """Download all images of a chapter
+
+    Image downloads start while the chapter is still being crawled.
+
+    Args:
+        archive (cbz.StreamingArchive): Write the images into this archive
+            instead of into folder.
+
+    Returns:
+        list: File names of the images in reading order
+
+    """
+    downloads = []
+    page_idx = -1
+    async for image in crawl_chapter_async(session, semaphore, chapter_url):
+        page_idx += 1
+        file_path = image_file_path(image, volume_idx, chapter_idx, folder)
+        if archive is None:
+            download = download_image_async(session,
+                                            semaphore,
+                                            image,
+                                            volume_idx,
+                                            chapter_idx,
+                                            folder)
+        else:
+            archive.set_position(file_path.name, (chapter_idx, page_idx))
+            if file_path.name in archive:
+                continue
+            download = stream_image_async(session,
+                                          semaphore,
+                                          image,
+                                          file_path.name,
+                                          archive)
+        downloads.append(asyncio.ensure_future(download))
+    return list(await asyncio.gather(*downloads))
+
+
+async def download_volume_async(session, semaphore, url, chapters_links,
+                                volume_idx, folder, zip_chapter=False,
+                                stream=False):
+    """Download all chapters of a volume concurrently and zip them
+
+    Args:
+        chapters_links (list): Urls to the chapters of the volume.
+        volume_idx (int): Zero-based index of the volume.
+        stream (bool): Write images straight into the zip files.
+
+    """
+    print("Downloading volume {:03}".format(volume_idx + 1))
+    if stream:
+        await stream_volume_async(session, semaphore, url, chapters_links,
+                                  volume_idx, zip_chapter)
+        return
+    chapters_filenames = await asyncio.gather(*[
+        download_chapter_async(session,
+                               semaphore,
+                               chapter,
+                               volume_idx,
+                               chapter_idx,
+                               folder)
+        for chapter_idx, chapter in enumerate(chapters_links)])
+
+    loop = asyncio.get_running_loop()
+    if zip_chapter:
+        for chapter_idx, filenames in enumerate(chapters_filenames):
+            await loop.run_in_executor(
+                None,
+                create_zip_file,
+                zip_file_name(url, volume_idx, chapter_idx),
+                filenames)
+    else:
+        await loop.run_in_executor(
+            None,
+            create_zip_file,
+            zip_file_name(url, volume_idx, len(chapters_links) - 1),
+            list(itertools.chain.from_iterable(chapters_filenames)))
+
+
+async def stream_volume_async(session, semaphore, url, chapters_links,
+                              volume_idx, zip_chapter=False):
+    """Download all chapters of a volume straight into their zip files"""
+    with contextlib.ExitStack() as archives:
+        if zip_chapter:
+            chapter_archives = [
+                archives.enter_context(cbz.StreamingArchive(
+                    zip_file_name(url, volume_idx, chapter_idx)))
+                for chapter_idx in range(len(chapters_links))
+            ]
+        else:
+            archive = archives.enter_context(cbz.StreamingArchive(
+                zip_file_name(url, volume_idx, len(chapters_links) - 1)))
+            chapter_archives = [archive] * len(chapters_links)
+        await asyncio.gather(*[
+            download_chapter_async(session,
+                                   semaphore,
+                                   chapter,
+                                   volume_idx,
+                                   chapter_idx,
+                                   pathlib.Path(),
+                                   chapter_archives[chapter_idx])
+            for chapter_idx, chapter in enumerate(chapters_links)])
+
+
+async def download_manga_async(url, folder, number=None, zip_chapter=False,
+                               concurrency=6, stream=False):
+    """Download one or all volumes with a single pooled session
+
+    Args:
+        url (string): Url to the manga
+        number (int): Zero-based index of the volume to download, all
+            volumes if None
+        concurrency (int): Number of requests in flight. Defaults to 6.
+        stream (bool): Write images straight into the zip files.
+
+    """
+    if not stream and not folder.exists():
+        folder.mkdir(parents=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        page = await fetch_page_async(session, url)
+        chapters_list = await parse_executor.run(parse_chapters_list, page)
+        if number is not None:
+            volumes = [(number, chapters_list[number])]
+        else:
+            volumes = enumerate(chapters_list)
+        # All volumes at once, the semaphore keeps the requests in flight
+        # bounded and each volume is zipped as soon as it is complete
+        await asyncio.gather(*[
+            download_volume_async(session,
+                                  semaphore,
+                                  url,
+                                  chapters_links,
+                                  volume_idx,
+                                  folder,
+                                  zip_chapter,
+                                  stream)
+            for volume_idx, chapters_links in volumes
+            if chapters_links])
 
 
 def main():
     arguments = dopt.docopt(__doc__)
-    if arguments.get('<number>', None) is not None:
+    if arguments.get('--async', False):
+        number = arguments.get('<number>', None)
+        asyncio.run(download_manga_async(
+            arguments['<manga_url>'],
+            pathlib.Path(arguments.get('--folder') or 'downloads'),
+            int(number) if number is not None else None,
+            arguments.get('--chapter', False),
+            int(arguments['--concurrency']),
+            arguments.get('--stream', False)))
+        parse_executor.shutdown()
+    elif arguments.get('<number>', None) is not None:
         download_volume(arguments['<manga_url>'],
                         int(arguments['<number>']),
-                        pathlib.Path(arguments.get('--folder', 'downloads')),
-                        arguments.get('--chapter', False))
+                        pathlib.Path(arguments.get('--folder') or 'downloads'),
+                        arguments.get('--chapter', False),
+                        stream=arguments.get('--stream', False))
     else:
         download_complete_manga(arguments['<manga_url>'],
                                 pathlib.Path(arguments.get(
-                                    '--folder', 'downloads')),
-                                arguments.get('--chapter', False))
+                                    '--folder') or 'downloads'),
+                                arguments.get('--chapter', False),
+                                stream=arguments.get('--stream', False))
 
 if __name__ == '__main__':
     main()
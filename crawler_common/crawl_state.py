@@ -0,0 +1,134 @@
+"""Persistent crawl frontier
+
+Every URL a crawl discovers is recorded with the stage that handles it,
+e.g. listing or recipe, and is pending until the stage finishes it. A
+resumed crawl continues with the pending URLs instead of rediscovering
+them, and URLs that are done are skipped without looking at the output.
+A URL failing `max_errors` times is given up on instead of being retried
+by every run.
+"""
+
+import hashlib
+import pathlib as pl
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple, Union
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fetched_at REAL,
+    content_hash TEXT,
+    errors INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+)
+'''
+
+
+def content_hash(content: Union[str, bytes, None]) -> Optional[str]:
+    if content is None:
+        return None
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class CrawlState:
+    def __init__(self, path, max_errors: int = 3):
+        self.path = pl.Path(path)
+        self.max_errors = max_errors
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute(SCHEMA)
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS urls_status '
+                'ON urls (status, stage)')
+
+    def status(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT status FROM urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, stage: str, urls: Iterable[str]) -> List[str]:
+        """Record `urls` as pending and return the ones not known before"""
+        added = []
+        with self._lock, self._db:
+            for url in urls:
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO urls (url, stage, status) '
+                    'VALUES (?, ?, ?)',
+                    (url, stage, PENDING))
+                if cursor.rowcount:
+                    added.append(url)
+        return added
+
+    def done(self, url: str, digest: str = None):
+        """Mark `url` done, `digest` is the `content_hash` of its page"""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE urls SET status = ?, fetched_at = ?, '
+                'content_hash = ?, last_error = NULL WHERE url = ?',
+                (DONE, time.time(), digest, url))
+
+    def failed(self, url: str, error):
+        """Count a failure, `url` stays pending until `max_errors`"""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE urls SET errors = errors + 1, fetched_at = ?, '
+                'last_error = ?, '
+                'status = CASE WHEN errors + 1 >= ? THEN ? ELSE ? END '
+                'WHERE url = ?',
+                (time.time(), str(error), self.max_errors, FAILED, PENDING,
+                 url))
+
+    def pending(self, stage: str = None) -> List[Tuple[str, str]]:
+        """(stage, url) of every pending URL, optionally of one stage"""
+        query = 'SELECT stage, url FROM urls WHERE status = ?'
+        args = (PENDING,)
+        if stage is not None:
+            query += ' AND stage = ?'
+            args += (stage,)
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+    def has_stage(self, stage: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT 1 FROM urls WHERE stage = ? LIMIT 1',
+                (stage,)).fetchone()
+        return row is not None
+
+    def reset(self, stages: Iterable[str]):
+        """Mark the URLs of `stages` pending again, e.g. to find new links"""
+        with self._lock, self._db:
+            self._db.executemany(
+                'UPDATE urls SET status = ?, errors = 0 WHERE stage = ?',
+                [(PENDING, stage) for stage in stages])
+
+    def counts(self) -> List[Tuple[str, str, int]]:
+        with self._lock:
+            return self._db.execute(
+                'SELECT stage, status, COUNT(*) FROM urls '
+                'GROUP BY stage, status ORDER BY stage, status').fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
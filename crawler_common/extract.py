@@ -0,0 +1,49 @@
+"""Pluggable page extractors with cheap fast paths
+
+An `Extractor` tries its strategies in order. Every strategy but the
+last may miss, by returning None or by failing on markup it doesn't
+expect. The last strategy is normally a full BeautifulSoup parse and
+its result or error is final.
+"""
+
+import logging
+from typing import Callable, Optional, TypeVar
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+HTML_PARSER = 'html.parser'
+
+
+class Extractor:
+    def __init__(self, *strategies: Callable[[str], Optional[T]]):
+        if not strategies:
+            raise ValueError("Extractor needs at least one strategy")
+        self.strategies = strategies
+
+    def __call__(self, page: str) -> T:
+        *fast_paths, fallback = self.strategies
+        for strategy in fast_paths:
+            try:
+                result = strategy(page)
+            except (AttributeError, KeyError, TypeError):
+                result = None
+            if result is not None:
+                return result
+            logger.debug("%s missed, falling back", strategy.__name__)
+        return fallback(page)
+
+
+def strained_soup(page: str, *args, **kwargs) -> BeautifulSoup:
+    """Parse only the tags matching a SoupStrainer built from the arguments
+
+    Everything outside the matching tags is skipped instead of being
+    turned into a tree.
+    """
+    return BeautifulSoup(
+        page,
+        HTML_PARSER,
+        parse_only=SoupStrainer(*args, **kwargs))
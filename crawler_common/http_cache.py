@@ -0,0 +1,338 @@
+"""On-disk HTTP cache shared by all crawlers
+
+Bodies are stored content-addressed under `bodies/`, the metadata
+(validators, timestamps, sizes) lives in a sqlite index next to them.
+Entries younger than `ttl` are served without touching the network,
+older ones are revalidated with If-None-Match / If-Modified-Since so an
+unchanged page costs a 304. The least recently used entries are evicted
+once the bodies exceed `max_size`.
+
+Only successful (200) responses are cached. Requests that do go to the
+network take a token from the rate limiter first, cache hits don't.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import hashlib
+import os
+import pathlib as pl
+import sqlite3
+import threading
+import time
+from typing import Dict, Mapping, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from crawler_common import rate_limit
+
+DEFAULT_CACHE_PATH = pl.Path('./.http_cache')
+DEFAULT_TTL = 60 * 60
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+HTTP_OK = 200
+HTTP_NOT_MODIFIED = 304
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    body_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+'''
+_ENTRY_COLUMNS = ('url, body_hash, size, content_type, etag, last_modified, '
+                  'stored_at, accessed_at')
+
+
+class HTTPError(IOError):
+    pass
+
+
+@dataclass
+class CachedResponse:
+    """Minimal response shared by the requests and the aiohttp paths"""
+    url: str
+    status_code: int
+    content: bytes
+    headers: Mapping[str, str] = field(default_factory=CaseInsensitiveDict)
+    encoding: Optional[str] = None
+    from_cache: bool = False
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(
+            self.encoding or _charset(self.headers.get('Content-Type')),
+            errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(
+                "Request error: {} for '{}'".format(
+                    self.status_code,
+                    self.url))
+
+
+@dataclass(frozen=True)
+class _Entry:
+    url: str
+    body_hash: str
+    size: int
+    content_type: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+    accessed_at: float
+
+
+def _charset(content_type: Optional[str]) -> str:
+    for parameter in (content_type or '').split(';')[1:]:
+        key, _, value = parameter.strip().partition('=')
+        if key.lower() == 'charset' and value:
+            return value.strip('"')
+    return 'utf-8'
+
+
+class HttpCache:
+    def __init__(
+            self,
+            path: os.PathLike = DEFAULT_CACHE_PATH,
+            ttl: float = DEFAULT_TTL,
+            max_size: int = DEFAULT_MAX_SIZE,
+            rate_limiter: Optional[rate_limit.RateLimiter] = (
+                rate_limit.DEFAULT_LIMITER),
+    ):
+        self.path = pl.Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.rate_limiter = rate_limiter
+        self._local = threading.local()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Connections must not be shared between threads or with forked
+        # pool workers
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            (self.path / 'bodies').mkdir(parents=True, exist_ok=True)
+            local.db = sqlite3.connect(
+                str(self.path / 'index.sqlite3'),
+                timeout=30,
+                isolation_level=None)
+            local.db.execute(_SCHEMA)
+            local.pid = os.getpid()
+        return local.db
+
+    def get(self, url: str, session=requests, **kwargs) -> CachedResponse:
+        """Cached equivalent of `session.get(url, **kwargs)`"""
+        entry, cached = self._lookup(url)
+        if cached is not None:
+            return cached
+        headers = kwargs.pop('headers', None)
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(url)
+            response = session.get(
+                url,
+                headers=self._request_headers(entry, headers),
+                **kwargs)
+            cached = self._finish(
+                url,
+                entry,
+                response.status_code,
+                response.headers,
+                response.content)
+            if cached is not None:
+                return cached
+            # Not modified, but the body is gone, ask for it again
+            entry = None
+
+    async def aget(self, session, url, **kwargs) -> CachedResponse:
+        """Cached equivalent of `session.get(url, **kwargs)` for aiohttp
+
+        The index lookups and the reads and writes of the bodies run in
+        the loop's default executor, so they don't stall other requests.
+        """
+        url = str(url)
+        loop = asyncio.get_running_loop()
+        entry, cached = await loop.run_in_executor(None, self._lookup, url)
+        if cached is not None:
+            return cached
+        headers = kwargs.pop('headers', None)
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.await_token(url)
+            async with session.get(
+                    url,
+                    headers=self._request_headers(entry, headers),
+                    **kwargs) as response:
+                content = await response.read()
+                status = response.status
+                response_headers = CaseInsensitiveDict(response.headers)
+            cached = await loop.run_in_executor(
+                None,
+                self._finish,
+                url,
+                entry,
+                status,
+                response_headers,
+                content)
+            if cached is not None:
+                return cached
+            # Not modified, but the body is gone, ask for it again
+            entry = None
+
+    def _lookup(self, url: str):
+        row = self.db.execute(
+            'SELECT {} FROM entries WHERE url = ?'.format(_ENTRY_COLUMNS),
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None, None
+        entry = _Entry(*row)
+        if time.time() - entry.stored_at < self.ttl:
+            response = self._load(entry)
+            if response is not None:
+                return entry, response
+            entry = None
+        return entry, None
+
+    @staticmethod
+    def _request_headers(
+            entry: Optional[_Entry],
+            headers: Optional[Mapping[str, str]],
+    ) -> Dict[str, str]:
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def _finish(
+            self,
+            url: str,
+            entry: Optional[_Entry],
+            status: int,
+            headers: Mapping[str, str],
+            content: bytes,
+    ) -> Optional[CachedResponse]:
+        """Store the response, None if it was a 304 for a lost body"""
+        now = time.time()
+        if status == HTTP_NOT_MODIFIED and entry is not None:
+            self.db.execute(
+                'UPDATE entries SET stored_at = ?, accessed_at = ?, '
+                'etag = coalesce(?, etag), '
+                'last_modified = coalesce(?, last_modified) WHERE url = ?',
+                (now, now, headers.get('ETag'), headers.get('Last-Modified'),
+                 url))
+            response = self._load(entry)
+            if response is not None:
+                return response
+            # The body is gone, drop the entry so it's fetched again
+            # without validators
+            self._delete(url, entry.body_hash)
+            return None
+
+        response = CachedResponse(
+            url,
+            status,
+            content,
+            CaseInsensitiveDict(headers))
+        if status != HTTP_OK:
+            return response
+
+        body_hash = hashlib.sha256(content).hexdigest()
+        body_path = self._body_path(body_hash)
+        if not body_path.is_file():
+            body_path.parent.mkdir(exist_ok=True)
+            temporary_path = body_path.with_suffix('.{}'.format(os.getpid()))
+            temporary_path.write_bytes(content)
+            temporary_path.replace(body_path)
+        self.db.execute(
+            'INSERT OR REPLACE INTO entries ({}) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(_ENTRY_COLUMNS),
+            (url, body_hash, len(content), headers.get('Content-Type'),
+             headers.get('ETag'), headers.get('Last-Modified'), now, now))
+        if entry is not None and entry.body_hash != body_hash:
+            self._delete_unreferenced(entry.body_hash)
+        self._evict()
+        return response
+
+    def _load(self, entry: _Entry) -> Optional[CachedResponse]:
+        try:
+            content = self._body_path(entry.body_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+        self.db.execute(
+            'UPDATE entries SET accessed_at = ? WHERE url = ?',
+            (time.time(), entry.url))
+        headers = CaseInsensitiveDict()
+        if entry.content_type is not None:
+            headers['Content-Type'] = entry.content_type
+        return CachedResponse(
+            entry.url,
+            HTTP_OK,
+            content,
+            headers,
+            from_cache=True)
+
+    def _body_path(self, body_hash: str) -> pl.Path:
+        return self.path / 'bodies' / body_hash[:2] / body_hash
+
+    def _evict(self):
+        total, = self.db.execute(
+            'SELECT coalesce(sum(size), 0) FROM entries').fetchone()
+        if total <= self.max_size:
+            return
+        rows = self.db.execute(
+            'SELECT url, body_hash, size FROM entries '
+            'ORDER BY accessed_at').fetchall()
+        for url, body_hash, size in rows:
+            if total <= self.max_size:
+                break
+            self._delete(url, body_hash)
+            total -= size
+
+    def _delete(self, url: str, body_hash: str):
+        self.db.execute('DELETE FROM entries WHERE url = ?', (url,))
+        self._delete_unreferenced(body_hash)
+
+    def _delete_unreferenced(self, body_hash: str):
+        referenced = self.db.execute(
+            'SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1',
+            (body_hash,),
+        ).fetchone()
+        if referenced is None:
+            try:
+                self._body_path(body_hash).unlink()
+            except FileNotFoundError:
+                pass
+
+
+_default_cache: Optional[HttpCache] = None
+
+
+def default_cache() -> HttpCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = HttpCache()
+    return _default_cache
+
+
+def get(url: str, **kwargs) -> CachedResponse:
+    return default_cache().get(url, **kwargs)
+
+
+async def aget(session, url, **kwargs) -> CachedResponse:
+    return await default_cache().aget(session, url, **kwargs)
+
+
+# These take their own rate limiter tokens, see retry.RetryPolicy
+HttpCache.get.limits_rate = HttpCache.aget.limits_rate = True
+get.limits_rate = aget.limits_rate = True
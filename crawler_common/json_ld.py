@@ -0,0 +1,86 @@
+"""schema.org JSON-LD without a DOM
+
+Pages embedding their data as `<script type="application/ld+json">` are
+scanned for those blocks with a regular expression and only the blocks
+are decoded, the rest of the page is never parsed. Meant as the fast
+path of an `extract.Extractor`, so everything here returns None for
+pages without the data instead of raising.
+"""
+
+import html
+import json
+import logging
+import re
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_RE = re.compile(
+    r'<script\b[^>]*\btype\s*=\s*["\']?application/ld\+json["\']?[^>]*>'
+    r'(.*?)</script\s*>',
+    re.IGNORECASE | re.DOTALL)
+
+
+def _objects(data) -> Iterator[dict]:
+    if isinstance(data, list):
+        for item in data:
+            yield from _objects(item)
+    elif isinstance(data, dict):
+        yield data
+        yield from _objects(data.get('@graph'))
+
+
+def _has_type(item: dict, type_: str) -> bool:
+    types = item.get('@type')
+    if isinstance(types, str):
+        types = [types]
+    return type_ in (types or ())
+
+
+def find(page: str, type_: str) -> Optional[dict]:
+    """First JSON-LD object of the schema.org `type_` in `page`"""
+    for match in SCRIPT_RE.finditer(page):
+        try:
+            data = json.loads(match.group(1).strip())
+        except ValueError:
+            logger.debug("Skipping invalid JSON-LD block")
+            continue
+        for item in _objects(data):
+            if _has_type(item, type_):
+                return item
+    return None
+
+
+def as_list(value) -> List:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def text(value) -> Optional[str]:
+    """Plain text of a value, HowToStep/HowToSection lists become lines"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return html.unescape(value).strip()
+    if isinstance(value, list):
+        lines = (text(item) for item in value)
+        return '\n'.join(line for line in lines if line)
+    if isinstance(value, dict):
+        if 'itemListElement' in value:
+            return text(value['itemListElement'])
+        return text(value.get('text') or value.get('name'))
+    return str(value)
+
+
+def texts(value, separator: str = None) -> List[str]:
+    """Plain text of every item of a value that may be a single item
+
+    A single string is split at `separator` if given, like keywords
+    usually are at commas.
+    """
+    if separator is not None and isinstance(value, str):
+        value = value.split(separator)
+    return [x for x in (text(item) for item in as_list(value)) if x]
@@ -0,0 +1,90 @@
+"""Paginated listings
+
+The number of pages is read from the first page: its pager links to the
+other pages of the same listing through a query parameter, the highest
+value linked is the last page. The links are found with a regular
+expression, so this works on the raw page before or without parsing it.
+"""
+
+import concurrent.futures
+from dataclasses import dataclass
+import html
+import re
+from typing import Callable, Iterable, Iterator, List
+import urllib.parse
+
+HREF_RE = re.compile(r'href\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Pagination:
+    """How a site numbers the pages of a listing
+
+    Args:
+        param: Query parameter holding the page number.
+        first: Number of the first page, the one without the parameter.
+
+    """
+
+    param: str = 'page'
+    first: int = 1
+
+    def page_url(self, url: str, number: int) -> str:
+        parts = urllib.parse.urlsplit(url)
+        query = [(key, value)
+                 for key, value in urllib.parse.parse_qsl(parts.query)
+                 if key != self.param]
+        if number != self.first:
+            query.append((self.param, str(number)))
+        return urllib.parse.urlunsplit(
+            parts._replace(query=urllib.parse.urlencode(query)))
+
+    def last_page(self, url: str, page: str) -> int:
+        path = urllib.parse.urlsplit(url).path
+        last = self.first
+        for match in HREF_RE.finditer(page):
+            link = urllib.parse.urlsplit(
+                urllib.parse.urljoin(url, html.unescape(match.group(1))))
+            if link.path != path:
+                continue
+            for value in urllib.parse.parse_qs(link.query).get(
+                    self.param, ()):
+                if value.isdigit():
+                    last = max(last, int(value))
+        return last
+
+    def remaining(self, url: str, page: str) -> List[str]:
+        """URLs of the pages after `page`, the first page of `url`"""
+        return [self.page_url(url, number)
+                for number in range(self.first + 1,
+                                    self.last_page(url, page) + 1)]
+
+
+def iter_listing(
+        url: str,
+        fetch: Callable[[str], str],
+        parse: Callable[[str], Iterable[str]],
+        pagination: Pagination = Pagination(),
+        max_workers: int = 4,
+) -> Iterator[str]:
+    """Yield the links `parse` finds on every page of the listing `url`
+
+    The first page is fetched on its own to learn the page count, the
+    others are fetched by at most `max_workers` threads at a time. Links
+    are yielded as soon as their page is parsed, in no particular order
+    after the first page.
+    """
+    first_page = fetch(url)
+    yield from parse(first_page)
+    urls = pagination.remaining(url, first_page)
+    if not urls:
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(lambda x: list(parse(fetch(x))), x)
+                   for x in urls]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
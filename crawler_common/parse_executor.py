@@ -0,0 +1,61 @@
+"""Run CPU bound parsing off the asyncio event loop
+
+`run` hands a function to the configured executor, so parsing one page
+doesn't stall every other download in flight. Functions and their
+arguments and results must be picklable for the process pool.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+from typing import Callable, Optional
+
+EXECUTOR_PROCESS = 'process'
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_INLINE = 'inline'
+
+_kind = EXECUTOR_PROCESS
+_max_workers: Optional[int] = None
+_executor: Optional[concurrent.futures.Executor] = None
+
+
+def configure(kind: str = EXECUTOR_PROCESS, max_workers: int = None):
+    """Select the executor used by `run`
+
+    Args:
+        kind: One of 'process', 'thread' or 'inline'. 'inline' parses
+            on the event loop, as if no executor was used.
+        max_workers: Passed to the executor, defaults to its own default.
+
+    """
+    global _kind, _max_workers
+    if kind not in (EXECUTOR_PROCESS, EXECUTOR_THREAD, EXECUTOR_INLINE):
+        raise ValueError("Unknown parse executor: {}".format(kind))
+    shutdown()
+    _kind = kind
+    _max_workers = max_workers
+
+
+def _get_executor() -> concurrent.futures.Executor:
+    global _executor
+    if _executor is None:
+        if _kind == EXECUTOR_PROCESS:
+            _executor = concurrent.futures.ProcessPoolExecutor(_max_workers)
+        else:
+            _executor = concurrent.futures.ThreadPoolExecutor(_max_workers)
+    return _executor
+
+
+async def run(function: Callable, *args, **kwargs):
+    if _kind == EXECUTOR_INLINE:
+        return function(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(),
+        functools.partial(function, *args, **kwargs))
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
@@ -0,0 +1,152 @@
+"""Per-host request rate limit shared by threads, tasks and processes
+
+Every host gets a token bucket of `rate` requests per second with room
+for a burst of `burst` requests. The buckets live in shared memory
+behind a multiprocessing lock, so processes forked after the limiter was
+created, e.g. the workers of a multiprocessing pool, take their tokens
+from the same buckets as the parent. Hosts are hashed onto a fixed
+number of slots, hosts sharing a slot share their limit.
+
+A bucket is kept as the time its next token becomes free (GCRA). Taking
+a token only reserves it and returns how long to wait for it, the
+waiting happens outside the lock with `time.sleep` or `asyncio.sleep`.
+
+A 429 or 503 response halves the rate of its host, pauses the host for
+as long as Retry-After asks and empties its bucket, so no burst follows
+the pause. Throttle responses within `throttle_window` of the last one
+belong to the same event, e.g. requests that were already in flight,
+and don't slow the host down further. Afterwards the rate climbs back
+linearly, by `rate` per `recovery_time` seconds.
+"""
+
+import asyncio
+import logging
+import multiprocessing as mp
+import time
+import urllib.parse
+import zlib
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = frozenset({429, 503})
+
+DEFAULT_RATE = 4.0
+DEFAULT_BURST = 8
+DEFAULT_SLOTS = 256
+
+# Shared doubles per slot. A throttled interval of 0 means the host runs
+# at the full rate.
+_NEXT_FREE, _BLOCKED_UNTIL, _THROTTLED_AT, _THROTTLED_INTERVAL = range(4)
+_FIELDS = 4
+
+
+def _host(url) -> str:
+    return urllib.parse.urlsplit(str(url)).hostname or ''
+
+
+class RateLimiter:
+    """Token bucket per host
+
+    Args:
+        rate: Requests per second and host.
+        burst: Requests a host may get at once after being idle.
+        min_rate: Lowest rate 429s slow a host down to.
+        recovery_time: Seconds the rate of a throttled host takes to
+            climb by `rate`.
+        throttle_window: Seconds after a throttle response in which
+            further ones don't slow the host down again.
+        slots: Number of buckets hosts are hashed onto.
+
+    """
+
+    def __init__(
+            self,
+            rate: float = DEFAULT_RATE,
+            burst: int = DEFAULT_BURST,
+            min_rate: float = 0.1,
+            recovery_time: float = 60.0,
+            throttle_window: float = 5.0,
+            slots: int = DEFAULT_SLOTS):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.recovery_time = recovery_time
+        self.throttle_window = throttle_window
+        self.slots = slots
+        self._lock = mp.Lock()
+        self._buckets = mp.RawArray('d', slots * _FIELDS)
+        for slot in range(slots):
+            self._buckets[slot * _FIELDS + _THROTTLED_AT] = float('-inf')
+
+    def _slot(self, url) -> int:
+        host = _host(url).encode('utf-8')
+        return zlib.crc32(host) % self.slots * _FIELDS
+
+    def _interval(self, slot: int, now: float) -> float:
+        # Called with the lock held
+        buckets = self._buckets
+        throttled = buckets[slot + _THROTTLED_INTERVAL]
+        if not throttled:
+            return 1.0 / self.rate
+        rate = 1.0 / throttled + self.rate * (
+            now - buckets[slot + _THROTTLED_AT]) / self.recovery_time
+        if rate >= self.rate:
+            buckets[slot + _THROTTLED_INTERVAL] = 0.0
+            return 1.0 / self.rate
+        return 1.0 / rate
+
+    def reserve(self, url) -> float:
+        """Take a token for the host of `url`, return the seconds to wait"""
+        slot = self._slot(url)
+        buckets = self._buckets
+        with self._lock:
+            now = time.monotonic()
+            interval = self._interval(slot, now)
+            next_free = max(buckets[slot + _NEXT_FREE], now)
+            allowed_at = max(next_free - (self.burst - 1) * interval,
+                             buckets[slot + _BLOCKED_UNTIL])
+            buckets[slot + _NEXT_FREE] = next_free + interval
+        return max(allowed_at - now, 0.0)
+
+    def wait(self, url):
+        delay = self.reserve(url)
+        if delay:
+            time.sleep(delay)
+
+    async def await_token(self, url):
+        delay = self.reserve(url)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def feedback(self, url, status: Optional[int],
+                 retry_after: Optional[float] = None):
+        """Slow the host of `url` down if `status` says it's throttling us"""
+        if status not in THROTTLE_STATUSES:
+            return
+        slot = self._slot(url)
+        buckets = self._buckets
+        with self._lock:
+            now = time.monotonic()
+            if now < max(buckets[slot + _BLOCKED_UNTIL],
+                         buckets[slot + _THROTTLED_AT] +
+                         self.throttle_window):
+                # Part of the throttle event already slowed down for
+                return
+            interval = min(self._interval(slot, now) * 2,
+                           1.0 / self.min_rate)
+            pause = retry_after if retry_after is not None else interval
+            blocked_until = now + pause
+            buckets[slot + _THROTTLED_AT] = now
+            buckets[slot + _THROTTLED_INTERVAL] = interval
+            buckets[slot + _BLOCKED_UNTIL] = blocked_until
+            # An empty bucket, the first token is free when the pause
+            # ends and the others follow one interval apart
+            buckets[slot + _NEXT_FREE] = max(
+                buckets[slot + _NEXT_FREE],
+                blocked_until + (self.burst - 1) * interval)
+        logger.info("%s throttled us, slowing down to %.2f requests/s",
+                    _host(url), 1 / interval)
+
+
+DEFAULT_LIMITER = RateLimiter()
@@ -0,0 +1,305 @@
+"""Retry policy shared by the requests and the aiohttp crawlers
+
+Failed requests are retried with exponential backoff and full jitter,
+429/503 responses wait at least as long as their Retry-After header
+asks. Retries are paid from a budget that grows with the number of
+requests made, so a throttling event can't turn into a retry storm, and
+a host on which several requests in a row failed is short-circuited:
+requests to it wait until the cooldown passed and a single trial request
+succeeded. Only connection errors and timeouts are retried, an invalid
+URL or a local error fails right away. Every attempt
+first takes a token from the per-host rate limiter, which slows hosts
+down that answer with 429 or 503.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Type
+import urllib.parse
+
+import requests
+
+from crawler_common import rate_limit
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+RETRY_EXCEPTIONS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    asyncio.TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# Longest single sleep while waiting for an open circuit, so waiting
+# requests notice soon when a trial request closed it again
+BREAKER_POLL = 1.0
+
+
+class RetryError(IOError):
+    pass
+
+
+class CircuitOpenError(RetryError):
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header value"""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+def _status(response) -> Optional[int]:
+    # requests and CachedResponse use status_code, aiohttp uses status
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(response, 'status', None)
+    return status
+
+
+def _host(url) -> str:
+    return urllib.parse.urlsplit(str(url)).hostname or ''
+
+
+class _Breaker:
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+
+class RetryPolicy:
+    """Decide whether, and after how long, a failed request is retried
+
+    Args:
+        attempts: Maximum number of attempts per request.
+        base_delay: Backoff before the first retry, doubled per retry.
+        max_delay: Upper bound for the backoff and for Retry-After.
+        budget_ratio: Retry tokens earned per request made.
+        max_budget: Retry tokens available from the start and the most
+            that can be saved up. Every retry costs one token.
+        breaker_threshold: Consecutive failed requests, each after all
+            its attempts, after which a host is short-circuited.
+        breaker_cooldown: Seconds a short-circuited host is left alone
+            before a single trial request is let through.
+        breaker_wait: Wait for a short-circuited host to be tried again
+            instead of raising CircuitOpenError.
+        exceptions: Exceptions that count as a failed attempt.
+        rate_limiter: Limiter every attempt waits for, None to send
+            requests as fast as possible.
+
+    A policy may be shared by threads. The retry budget and the breakers
+    are kept per process: every worker of a multiprocessing pool has
+    its own copy and counts only its own requests, unlike the rate
+    limiter, which is shared between processes.
+    """
+
+    def __init__(
+            self,
+            attempts: int = 4,
+            base_delay: float = 0.5,
+            max_delay: float = 60.0,
+            budget_ratio: float = 0.2,
+            max_budget: float = 10.0,
+            breaker_threshold: int = 5,
+            breaker_cooldown: float = 30.0,
+            breaker_wait: bool = True,
+            exceptions: Tuple[Type[BaseException], ...] = RETRY_EXCEPTIONS,
+            rate_limiter: Optional[rate_limit.RateLimiter] = (
+                rate_limit.DEFAULT_LIMITER),
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.max_budget = max_budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breaker_wait = breaker_wait
+        self.exceptions = exceptions
+        self.rate_limiter = rate_limiter
+        self.budget = max_budget
+        self._breakers: Dict[str, _Breaker] = {}
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        delay = random.uniform(
+            0,
+            min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, url, request: Callable, *args, **kwargs):
+        """Call `request(*args, **kwargs)` for `url`, retrying failures
+
+        Returns the last response, which may still carry an error
+        status once the attempts or the budget are used up.
+        """
+        host = _host(url)
+        delay = self._breaker_delay(host)
+        while delay:
+            time.sleep(delay)
+            delay = self._breaker_delay(host)
+        for attempt in range(self.attempts):
+            self._before_attempt(attempt)
+            if self._limit_rate(request):
+                self.rate_limiter.wait(url)
+            try:
+                response = request(*args, **kwargs)
+            except self.exceptions as error:
+                delay = self._after_failure(host, attempt, url, error=error)
+                if delay is None:
+                    raise
+            else:
+                status = self._feedback(url, response)
+                if status not in RETRY_STATUSES:
+                    self._after_success(host)
+                    return response
+                delay = self._after_failure(host, attempt, url, response)
+                if delay is None:
+                    return response
+                _close(response)
+            time.sleep(delay)
+
+    async def acall(self, url, request: Callable, *args, **kwargs):
+        """Async version of `call` for coroutine functions"""
+        host = _host(url)
+        delay = self._breaker_delay(host)
+        while delay:
+            await asyncio.sleep(delay)
+            delay = self._breaker_delay(host)
+        for attempt in range(self.attempts):
+            self._before_attempt(attempt)
+            if self._limit_rate(request):
+                await self.rate_limiter.await_token(url)
+            try:
+                response = await request(*args, **kwargs)
+            except self.exceptions as error:
+                delay = self._after_failure(host, attempt, url, error=error)
+                if delay is None:
+                    raise
+            else:
+                status = self._feedback(url, response)
+                if status not in RETRY_STATUSES:
+                    self._after_success(host)
+                    return response
+                delay = self._after_failure(host, attempt, url, response)
+                if delay is None:
+                    return response
+                _close(response)
+            await asyncio.sleep(delay)
+
+    def _limit_rate(self, request: Callable) -> bool:
+        # The HTTP cache only takes tokens for requests that miss it
+        return self.rate_limiter is not None and \
+            not getattr(request, 'limits_rate', False)
+
+    def _feedback(self, url, response) -> Optional[int]:
+        status = _status(response)
+        if self.rate_limiter is not None:
+            self.rate_limiter.feedback(
+                url,
+                status,
+                parse_retry_after(response.headers.get('Retry-After')))
+        return status
+
+    def _breaker_delay(self, host: str) -> float:
+        """Seconds to wait before a request to `host` may be made"""
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None or breaker.failures < self.breaker_threshold:
+                return 0.0
+            now = time.monotonic()
+            if now < breaker.open_until:
+                if not self.breaker_wait:
+                    raise CircuitOpenError(
+                        "Circuit open for '{}' for another {:.1f}s".format(
+                            host,
+                            breaker.open_until - now))
+                return min(breaker.open_until - now, BREAKER_POLL)
+            # Half open, this request is the trial. The others wait for
+            # another cooldown, unless the trial succeeds and closes it.
+            breaker.open_until = now + self.breaker_cooldown
+            return 0.0
+
+    def _before_attempt(self, attempt: int):
+        if attempt == 0:
+            with self._lock:
+                self.budget = min(
+                    self.budget + self.budget_ratio,
+                    self.max_budget)
+
+    def _after_success(self, host: str):
+        with self._lock:
+            self._breakers.pop(host, None)
+
+    def _after_failure(
+            self,
+            host: str,
+            attempt: int,
+            url,
+            response=None,
+            error: BaseException = None,
+    ) -> Optional[float]:
+        reason = error if error is not None else _status(response)
+        if attempt + 1 >= self.attempts:
+            logger.warning("Giving up on %s after %d attempts: %s",
+                           url, attempt + 1, reason)
+            self._request_failed(host)
+            return None
+        with self._lock:
+            exhausted = self.budget < 1
+            if not exhausted:
+                self.budget -= 1
+        if exhausted:
+            logger.warning("Retry budget exhausted, giving up on %s: %s",
+                           url, reason)
+            self._request_failed(host)
+            return None
+
+        retry_after = None
+        if response is not None:
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+        delay = self.backoff(attempt, retry_after)
+        logger.info("Retrying %s in %.2fs: %s", url, delay, reason)
+        return delay
+
+    def _request_failed(self, host: str):
+        # Counted once per request, its retries are not separate failures
+        with self._lock:
+            breaker = self._breakers.setdefault(host, _Breaker())
+            breaker.failures += 1
+            if breaker.failures >= self.breaker_threshold:
+                breaker.open_until = (
+                    time.monotonic() + self.breaker_cooldown)
+
+
+def _close(response):
+    # Hand the connection of a discarded response back to the pool
+    release = getattr(response, 'release', None) or \
+        getattr(response, 'close', None)
+    if release is not None:
+        release()
+
+
+DEFAULT_POLICY = RetryPolicy()
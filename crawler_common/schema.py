@@ -0,0 +1,139 @@
+"""Declarative page schemas, extracted in a single pass
+
+A `Schema` maps output keys to `Field`s. A field selects tags by one or
+more `(name, attrs)` steps, given like the arguments of `find`. Further
+steps must match the following descendants, so
+`Field(('section', {'id': 'a'}), ('p', {}))` selects the paragraphs
+inside that section. Attribute values match like they do for `find`,
+i.e. a class matches one of the classes or all of them joined by spaces,
+and an empty value matches a missing attribute.
+
+The selectors are indexed by tag name once, when the schema is created.
+Extraction parses only the `scope` element and visits every tag in it
+once, instead of walking the tree again for every field.
+"""
+
+from typing import Dict, Optional, Tuple
+
+from bs4 import Tag
+
+from crawler_common import extract
+
+Step = Tuple[str, Dict[str, str]]
+
+
+class MissingFieldError(AttributeError):
+    """A required field didn't match
+
+    An AttributeError, like the `None.text` hand written parsers fail
+    with, so extractor fallbacks treat it as a miss.
+    """
+
+
+REQUIRED = object()
+OMIT = object()
+
+
+def _value_matches(value, expected) -> bool:
+    if not expected:
+        return not value
+    if value is None:
+        return False
+    if isinstance(value, list):
+        return expected in value or ' '.join(value) == expected
+    return value == expected
+
+
+def _step_matches(tag: Tag, step: Step) -> bool:
+    name, attrs = step
+    return tag.name == name and all(
+        _value_matches(tag.get(key), expected)
+        for key, expected in attrs.items())
+
+
+class Field:
+    """Tags selected by `steps`, reduced to their text or an attribute
+
+    Args:
+        steps: `(name, attrs)` of the tag and of its ancestors, outermost
+            first.
+        attribute: Take this attribute instead of the text.
+        many: Collect every match into a list instead of the first one.
+        default: Value if nothing matched. `REQUIRED` raises a
+            MissingFieldError, `OMIT` leaves the key out of the result.
+            A field with `many` defaults to an empty list.
+
+    """
+
+    def __init__(
+            self,
+            *steps: Step,
+            attribute: Optional[str] = None,
+            many: bool = False,
+            default=REQUIRED):
+        if not steps:
+            raise ValueError("Field needs at least one step")
+        self.steps = tuple((name, dict(attrs)) for name, attrs in steps)
+        self.attribute = attribute
+        self.many = many
+        self.default = default
+
+    def matches(self, tag: Tag, scope: Tag) -> bool:
+        *ancestors, last = self.steps
+        if not _step_matches(tag, last):
+            return False
+        for parent in tag.parents:
+            if not ancestors:
+                break
+            if parent is scope:
+                break
+            if _step_matches(parent, ancestors[-1]):
+                ancestors.pop()
+        return not ancestors
+
+    def value(self, tag: Tag):
+        if self.attribute is None:
+            return tag.text
+        return tag.get(self.attribute)
+
+
+class Schema:
+    def __init__(self, scope: Step, **fields: Field):
+        self.scope = (scope[0], dict(scope[1]))
+        self.fields = fields
+        self._by_tag: Dict[str, list] = {}
+        for key, field in fields.items():
+            self._by_tag.setdefault(field.steps[-1][0], []).append(
+                (key, field))
+
+    def __call__(self, page: str) -> dict:
+        soup = extract.strained_soup(page, *self.scope)
+        scope = soup.find(*self.scope)
+        if scope is None:
+            raise MissingFieldError(
+                "Scope {} not found".format(self.scope))
+        return self.extract(scope)
+
+    def extract(self, scope: Tag) -> dict:
+        found = {key: [] for key in self.fields}
+        for tag in scope.descendants:
+            if not isinstance(tag, Tag):
+                continue
+            for key, field in self._by_tag.get(tag.name, ()):
+                if found[key] and not field.many:
+                    continue
+                if field.matches(tag, scope):
+                    found[key].append(field.value(tag))
+
+        out = {}
+        for key, field in self.fields.items():
+            values = found[key]
+            if field.many:
+                out[key] = values
+            elif values:
+                out[key] = values[0]
+            elif field.default is REQUIRED:
+                raise MissingFieldError("Field '{}' not found".format(key))
+            elif field.default is not OMIT:
+                out[key] = field.default
+        return out
@@ -0,0 +1,124 @@
+"""Crawl-wide sets of seen URLs
+
+Links are checked against a seen-set before anything else happens to
+them, so a recipe listed in dozens of collections costs one lookup in
+memory per duplicate. `SeenSet` is exact. `BloomFilter` needs a fixed,
+small amount of memory for any number of URLs and can be saved between
+runs, at the price of skipping a new URL with probability `error_rate`.
+Both count how many links were offered and how many were duplicates.
+"""
+
+import collections
+import hashlib
+import logging
+import math
+import os
+import pathlib as pl
+import struct
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SeenSet:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen = set()
+        self.offered = collections.Counter()
+        self.duplicates = collections.Counter()
+
+    def add(self, key: str, label: str = '') -> bool:
+        """Add `key`, return whether it wasn't seen before"""
+        with self._lock:
+            new = self._add(key)
+            self.offered[label] += 1
+            if not new:
+                self.duplicates[label] += 1
+        return new
+
+    def _add(self, key: str) -> bool:
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    def report(self) -> str:
+        lines = []
+        with self._lock:
+            for label, offered in sorted(self.offered.items()):
+                duplicates = self.duplicates[label]
+                lines.append("{}: {} links, {} duplicates ({:.1%})".format(
+                    label or 'all',
+                    offered,
+                    duplicates,
+                    duplicates / offered))
+        return '\n'.join(lines)
+
+    def save(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
+
+
+class BloomFilter(SeenSet):
+    """Seen-set of `capacity` keys with a false positive rate `error_rate`
+
+    With a `path` the filter is loaded from there if it exists and
+    written back on `save`.
+    """
+
+    HEADER = struct.Struct('>QI')
+
+    def __init__(
+            self,
+            capacity: int = 2000000,
+            error_rate: float = 1e-4,
+            path: Optional[str] = None):
+        super().__init__()
+        self.path = pl.Path(path) if path is not None else None
+        self.bits = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+        if self.path is not None and self.path.is_file():
+            self._load()
+
+    def _load(self):
+        data = self.path.read_bytes()
+        bits, hashes = self.HEADER.unpack_from(data)
+        array = bytearray(data[self.HEADER.size:])
+        if len(array) != (bits + 7) // 8:
+            logger.warning("Ignoring truncated bloom filter %s", self.path)
+            return
+        self.bits, self.hashes, self._array = bits, hashes, array
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.bits
+
+    def _add(self, key: str) -> bool:
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self._array[byte] & (1 << bit):
+                self._array[byte] |= 1 << bit
+                new = True
+        return new
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with self._lock:
+            with tmp_path.open('wb') as f:
+                f.write(self.HEADER.pack(self.bits, self.hashes))
+                f.write(self._array)
+        os.replace(str(tmp_path), str(self.path))
@@ -0,0 +1,129 @@
+"""Thread pool for crawls in which tasks discover further tasks
+
+Every task belongs to a stage, e.g. category, listing or recipe. Tasks
+may submit new tasks while they run; `join` returns once no task is
+queued or running anymore. Time spent queued and running is collected
+per stage, so it's visible where the workers stall.
+
+Leaving the queue's context on an exception, e.g. a KeyboardInterrupt
+while joining, cancels the queued tasks and only waits for the running
+ones. Tasks submitted while the queue shuts down are dropped.
+"""
+
+import collections
+import concurrent.futures
+from dataclasses import dataclass
+import logging
+import threading
+import time
+from typing import Callable, Dict, Set
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageStats:
+    tasks: int = 0
+    failed: int = 0
+    queued_seconds: float = 0.0
+    busy_seconds: float = 0.0
+
+
+class WorkQueue:
+    def __init__(self, workers: int = 8):
+        self.workers = workers
+        self.stages: Dict[str, StageStats] = collections.defaultdict(
+            StageStats)
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._futures: Set[concurrent.futures.Future] = set()
+        self._closed = False
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._started = time.perf_counter()
+
+    def submit(self, stage: str, function: Callable, *args, **kwargs):
+        with self._idle:
+            if self._closed:
+                logger.debug("Queue shut down, dropping %s task %s%s",
+                             stage, function.__name__, args)
+                return
+            self._pending += 1
+            future = self._executor.submit(
+                self._run,
+                stage,
+                time.perf_counter(),
+                function,
+                args,
+                kwargs)
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future):
+        with self._idle:
+            self._futures.discard(future)
+            if future.cancelled():
+                self._finished()
+
+    def _finished(self):
+        # Called with the lock held
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.notify_all()
+
+    def _run(self, stage, submitted, function, args, kwargs):
+        started = time.perf_counter()
+        failed = False
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            failed = True
+            logger.exception("%s task %s%s failed", stage,
+                             function.__name__, args)
+        finally:
+            finished = time.perf_counter()
+            with self._idle:
+                stats = self.stages[stage]
+                stats.tasks += 1
+                stats.failed += failed
+                stats.queued_seconds += started - submitted
+                stats.busy_seconds += finished - started
+                self._finished()
+
+    def join(self):
+        """Wait until all tasks, including the ones submitted by tasks, ran"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self._started
+        lines = ["{} workers, {:.1f}s".format(self.workers, elapsed)]
+        with self._idle:
+            for stage, stats in self.stages.items():
+                lines.append(
+                    "{}: {} tasks ({} failed), {:.0%} of worker time, "
+                    "{:.2f}s average queue wait".format(
+                        stage,
+                        stats.tasks,
+                        stats.failed,
+                        stats.busy_seconds / (elapsed * self.workers or 1),
+                        stats.queued_seconds / (stats.tasks or 1)))
+        return '\n'.join(lines)
+
+    def __enter__(self):
+        return self
+
+    def close(self, cancel: bool = False):
+        """Stop taking tasks and wait for the running ones
+
+        With `cancel`, queued tasks are cancelled instead of run.
+        """
+        with self._idle:
+            self._closed = True
+            futures = list(self._futures) if cancel else []
+        cancelled = sum(future.cancel() for future in futures)
+        if cancelled:
+            logger.info("Cancelled %d queued tasks", cancelled)
+        self._executor.shutdown()
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close(cancel=exc_type is not None)
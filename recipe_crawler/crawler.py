@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------------
+# "THE SCOTCH-WARE LICENSE" (Revision 42):
+# <don@0xbeef.org> wrote this file. As long as you retain this notice you
+# can do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a scotch whisky in return
+# Marco 'don' Kaulea
+# ----------------------------------------------------------------------------
+"""Resumable recipe crawls on a shared work queue
+
+A site subclasses `Crawl` and maps each stage, e.g. listing or recipe,
+to a handler `handler(crawl, url)`. Handlers `follow` the links they find
+into other stages and return the `content_hash` of the page they
+handled. Every URL goes through the crawl state, so each is handled
+once and an interrupted crawl resumes with the pending ones. A URL is
+only marked done once the sink stored what its handler wrote, URLs whose
+recipes were still buffered when the crawl was interrupted are handled
+again and find their recipe in the sink if it made it. A seen-set
+in front of the crawl state drops links followed before without a
+database lookup.
+"""
+
+from dataclasses import dataclass
+import functools
+from typing import Callable, ClassVar, Dict, Iterable
+
+from crawler_common import crawl_state, retry, seen_set, work_queue
+from recipe_crawler import sinks
+
+
+@dataclass
+class Crawl:
+    queue: work_queue.WorkQueue
+    state: crawl_state.CrawlState
+    sink: sinks.Sink
+    seen: seen_set.SeenSet
+
+    stages: ClassVar[Dict[str, Callable]] = {}
+
+    def follow(self, stage: str, urls: Iterable[str]):
+        """Queue the `urls` the crawl state doesn't know yet"""
+        urls = [url for url in urls if self.seen.add(url, stage)]
+        for url in self.state.add(stage, urls):
+            self.submit(stage, url)
+
+    def submit(self, stage: str, url: str):
+        self.queue.submit(stage, self._run_task, stage, url)
+
+    def _run_task(self, stage, url):
+        try:
+            digest = self.stages[stage](self, url)
+        except retry.CircuitOpenError:
+            # The host is down, not the URL, it stays pending as it was
+            raise
+        except Exception as error:
+            self.state.failed(url, error)
+            raise
+        self.sink.when_stored(
+            functools.partial(self.state.done, url, digest))
+
+    def run(self, stage: str, urls: Iterable[str]):
+        """Resume the pending URLs, follow `urls` and wait until done"""
+        for pending_stage, url in self.state.pending():
+            self.submit(pending_stage, url)
+        self.follow(stage, urls)
+        self.queue.join()
+        self.sink.flush()
+
+    def report(self):
+        print(self.queue.report())
+        print(self.seen.report())
+        for stage, status, count in self.state.counts():
+            print("{} {}: {}".format(stage, status, count))
+
+
+def open_seen_set(state: crawl_state.CrawlState, bloom: bool = False):
+    """Seen-set for a crawl, a bloom filter saved next to the crawl state
+
+    A saved filter is only used together with the crawl state it was
+    built with, it would skip every URL of a fresh crawl otherwise.
+    """
+    if not bloom:
+        return seen_set.SeenSet()
+    path = state.path.with_suffix('.bloom')
+    if not state.counts() and path.exists():
+        path.unlink()
+    return seen_set.BloomFilter(path=str(path))
@@ -12,110 +12,129 @@ Usage:
     goodfood recipe <url>
     goodfood recipes <url>
     goodfood categories <url>
-    goodfood scrape
+    goodfood scrape [--workers=N] [--sink=SINK] [--refresh] [--bloom]
+
+Options:
+    --workers=N  Number of pages fetched and parsed in parallel [default: 8]
+    --sink=SINK  Where recipes are stored, one of files, jsonl or sqlite
+                 [default: files]
+    --refresh    Revisit category and listing pages for new recipes
+    --bloom      Remember seen links in a bloom filter instead of a set
 """
 
 import bs4
 import docopt
-import functools
-import json
-import multiprocessing as mp
-import pathlib as pl
+from dataclasses import dataclass
 import re
 import requests
 
+from crawler_common import (
+    crawl_state,
+    extract,
+    http_cache,
+    json_ld,
+    pagination,
+    retry,
+    schema,
+    work_queue,
+)
+from recipe_crawler import crawler, sinks
+
 BASE_URL = 'http://www.bbcgoodfood.com'
 USER_AGENT = {'user-agent': 'spider'}
+# Collections are paged by Drupal, ?page=1 is the second page
+PAGINATION = pagination.Pagination(first=0)
+
+dump_json = sinks.dump_json
+
 
-dump_json = functools.partial(json.dumps,
-                              indent=4,
-                              ensure_ascii=False,
-                              sort_keys=True)
+def get_page(url, session=requests):
+    return retry.DEFAULT_POLICY.call(url,
+                                     http_cache.get,
+                                     url,
+                                     session=session,
+                                     headers=USER_AGENT)
+
+
+def make_session(pool_size):
+    """Session whose connection pool is shared by `pool_size` threads"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 def make_absolute(url):
     return "{}{}".format(BASE_URL, url)
 
 
-def parse_meta_tag(page, itemprop):
-    content = page.find('meta', {'itemprop': itemprop})
-    try:
-        content = content['content']
-    except TypeError:
-        return None
-    return content
+def itemprop(tag, prop, **kwargs):
+    return schema.Field((tag, {'itemprop': prop}), **kwargs)
 
 
-def parse_meta_tags(page, itemprop):
-    content = page.findAll('meta', {'itemprop': itemprop})
-    try:
-        content = [x['content'] for x in content]
-    except TypeError:
-        return None
-    return content
+def meta(prop, **kwargs):
+    return itemprop('meta', prop, attribute='content', **kwargs)
 
 
-def parse_recipe(page):
-    soup = bs4.BeautifulSoup(page)
-    main_content = soup.find('div', {'id': 'main-content',
-                                     'class': 'row main node-type-recipe'})
-    out = {}
-    ingredients = main_content.findAll('li', {'itemprop': 'ingredients'})
-    ingredients = [x.text for x in ingredients]
-    name = main_content.find('h1', {'itemprop': 'name'})
-    out['title'] = name.text
-    content = main_content.find('p', {'itemprop': 'description'})
-    out['description'] = content.text
-    content = main_content.find('li', {'itemprop': 'recipeInstructions'})
-    if content is not None:
-        out['instructions'] = content.text
-    content = main_content.find('section', {'itemprop': 'recipe-method'})
-    if content is not None:
-        out['method'] = content.find('div', {'class': 'field-item even'}).text
-
-    out['ingredients'] = ingredients
-    out['keywords'] = parse_meta_tags(main_content, 'keywords')
-    out['recipe_categories'] = parse_meta_tags(main_content, 'recipeCategory')
-    out['cook_time'] = parse_meta_tag(main_content, 'cookTime')
-    out['prep_time'] = parse_meta_tag(main_content, 'prepTime')
-    out['total_time'] = parse_meta_tag(main_content, 'totalTime')
+def parse_json_ld_recipe(page):
+    recipe = json_ld.find(page, 'Recipe')
+    if recipe is None or not recipe.get('name'):
+        return None
+    out = {
+        'title': json_ld.text(recipe['name']),
+        'description': json_ld.text(recipe.get('description')) or '',
+        'ingredients': json_ld.texts(recipe.get('recipeIngredient')),
+        'keywords': json_ld.texts(recipe.get('keywords'), ','),
+        'recipe_categories': json_ld.texts(recipe.get('recipeCategory')),
+        'cook_time': recipe.get('cookTime'),
+        'prep_time': recipe.get('prepTime'),
+        'total_time': recipe.get('totalTime'),
+    }
+    instructions = json_ld.text(recipe.get('recipeInstructions'))
+    if instructions:
+        out['instructions'] = instructions
     return out
 
 
-def get_subcategories(url):
-    r = requests.get(url, headers=USER_AGENT)
-    if r.status_code != 200:
-        raise requests.exceptions.RequestException(
-            "Request error: get_subcategories('{}')".format(url))
-    soup = bs4.BeautifulSoup(r.text)
+parse_dom_recipe = schema.Schema(
+    ('div', {'id': 'main-content', 'class': 'row main node-type-recipe'}),
+    title=itemprop('h1', 'name'),
+    description=itemprop('p', 'description'),
+    instructions=itemprop('li', 'recipeInstructions', default=schema.OMIT),
+    method=schema.Field(
+        ('section', {'itemprop': 'recipe-method'}),
+        ('div', {'class': 'field-item even'}),
+        default=schema.OMIT),
+    ingredients=itemprop('li', 'ingredients', many=True),
+    keywords=meta('keywords', many=True),
+    recipe_categories=meta('recipeCategory', many=True),
+    cook_time=meta('cookTime', default=None),
+    prep_time=meta('prepTime', default=None),
+    total_time=meta('totalTime', default=None),
+)
+
+parse_recipe = extract.Extractor(parse_json_ld_recipe, parse_dom_recipe)
+
+
+def parse_subcategories(page):
+    soup = bs4.BeautifulSoup(page)
     main_content = soup.find('div', {'id': 'main-content'})
     links = [x['href'] for x in main_content.findAll('a')]
     regex = re.compile('^/recipes/collection/[^/]*$')
-    links = filter(regex.match, links)
-    return links
+    return [make_absolute(x) for x in filter(regex.match, links)]
 
 
-def get_categories(url):
-    r = requests.get(url, headers=USER_AGENT)
-    if r.status_code != 200:
-        raise requests.exceptions.RequestException(
-            "Request error: get_categories('{}')".format(url))
-    soup = bs4.BeautifulSoup(r.text)
+def parse_categories(page):
+    soup = bs4.BeautifulSoup(page)
     navigation = soup.find('div', {'id': 'nav-touch', 'class': 'nav-touch'})
     links = [x['href'] for x in navigation.findAll('a')]
     regex = re.compile('^/recipes/category/[^/]*$')
-    links = filter(regex.match, links)
-    for category in links:
-        for subcategory in get_subcategories(make_absolute(category)):
-            yield make_absolute(subcategory)
+    return [make_absolute(x) for x in filter(regex.match, links)]
 
 
-def get_recipes(category_url):
-    r = requests.get(category_url, headers=USER_AGENT)
-    if r.status_code != 200:
-        raise requests.exceptions.RequestException(
-            "Request error: get_recipes('{}')".format(category_url))
-    soup = bs4.BeautifulSoup(r.text)
+def parse_recipe_list(page):
+    soup = bs4.BeautifulSoup(page)
     main_content = soup.find('div', {'id': 'main-content'})
     articles = main_content.findAll('article',
                                     {'itemtype': 'http://schema.org/Recipe'})
@@ -126,43 +145,129 @@ def get_recipes(category_url):
     return ret
 
 
-def scrape_recipe(url):
+def get_subcategories(url, session=requests):
+    r = get_page(url, session)
+    if r.status_code != 200:
+        raise requests.exceptions.RequestException(
+            "Request error: get_subcategories('{}')".format(url))
+    return parse_subcategories(r.text)
+
+
+def get_category_links(url, session=requests):
+    r = get_page(url, session)
+    if r.status_code != 200:
+        raise requests.exceptions.RequestException(
+            "Request error: get_categories('{}')".format(url))
+    return parse_categories(r.text)
+
+
+def get_categories(url, session=requests):
+    for category in get_category_links(url, session):
+        yield from get_subcategories(category, session)
+
+
+def get_recipes(category_url, session=requests):
+    """Recipe links of every page of a collection, as they are parsed"""
+    return pagination.iter_listing(
+        category_url,
+        lambda url: fetch_page(url, session).text,
+        parse_recipe_list,
+        PAGINATION)
+
+
+def fetch_page(url, session=requests):
+    r = get_page(url, session)
+    if r.status_code != 200:
+        raise requests.exceptions.RequestException(
+            "Request error: fetch_page('{}')".format(url))
+    return r
+
+
+def crawl_categories(crawl, url):
+    r = fetch_page(url, crawl.session)
+    crawl.follow('category', parse_categories(r.text))
+    return crawl_state.content_hash(r.content)
+
+
+def crawl_category(crawl, url):
+    r = fetch_page(url, crawl.session)
+    crawl.follow('listing', parse_subcategories(r.text))
+    return crawl_state.content_hash(r.content)
+
+
+def crawl_listing(crawl, url):
+    r = fetch_page(url, crawl.session)
+    crawl.follow('recipe', parse_recipe_list(r.text))
+    # The other pages of the collection are listings of their own, known
+    # ones are skipped when their pager is read again
+    crawl.follow('listing', PAGINATION.remaining(url, r.text))
+    return crawl_state.content_hash(r.content)
+
+
+def crawl_recipe(crawl, url):
     file_name = url.split('/')[-1]
-    file_path = pl.Path('goodfood') / file_name
-    if file_path.is_file():
-        return file_name
+    # Recipes scraped before the crawl state existed are only in the sink
+    if file_name in crawl.sink:
+        print(file_name)
+        return None
+    r = fetch_page(url, crawl.session)
     try:
-        r = requests.get(url, headers=USER_AGENT)
-        if r.status_code == 200:
-            recipe = parse_recipe(r.text)
-            with file_path.open('w') as f:
-                f.write(dump_json(recipe))
-    except TypeError:
-        print(url)
-        raise
-    except AttributeError:
+        crawl.sink.write(file_name, parse_recipe(r.text))
+    except (TypeError, AttributeError):
         print(url)
         raise
+    print(file_name)
+    return crawl_state.content_hash(r.content)
+
+
+@dataclass
+class GoodfoodCrawl(crawler.Crawl):
+    session: requests.Session
+
+    stages = {
+        'categories': crawl_categories,
+        'category': crawl_category,
+        'listing': crawl_listing,
+        'recipe': crawl_recipe,
+    }
+
+
+DISCOVERY_STAGES = ('categories', 'category', 'listing')
+
 
-    return file_name
+def scrape(workers=8, sink=sinks.SINK_FILES, refresh=False, bloom=False):
+    """Scrape every recipe reachable from the category navigation
 
+    Categories, their collections and the recipes listed in them are all
+    tasks of the same work queue, so recipes are fetched as soon as the
+    first collection was listed instead of one collection at a time.
 
-def scrape(processes=4):
-    with mp.Pool(processes=processes) as pool:
-        for category in get_categories(BASE_URL):
-            try:
-                recipe_list = get_recipes(category)
-            except requests.exceptions.RequestException:
-                continue
-            it = pool.imap_unordered(scrape_recipe, recipe_list)
-            for recipe in it:
-                print(recipe)
+    The crawl state in goodfood.state.sqlite lets an interrupted scrape
+    continue where it stopped. With `refresh`, the category and listing
+    pages are visited again to discover new recipes, recipes that are
+    done stay skipped. `bloom` keeps the seen links in a bloom filter
+    saved between runs, for crawls too large for a set in memory.
+    """
+    with crawl_state.CrawlState('goodfood.state.sqlite') as state, \
+            sinks.open_sink(sink, 'goodfood') as output, \
+            work_queue.WorkQueue(workers) as queue, \
+            crawler.open_seen_set(state, bloom) as seen:
+        if refresh:
+            state.reset(DISCOVERY_STAGES)
+        scraper = GoodfoodCrawl(
+            queue,
+            state,
+            output,
+            seen,
+            make_session(workers))
+        scraper.run('categories', [BASE_URL])
+        scraper.report()
 
 
 def main():
     arguments = docopt.docopt(__doc__)
     if arguments.get('recipe', False):
-        r = requests.get(arguments['<url>'], headers=USER_AGENT)
+        r = get_page(arguments['<url>'])
         if r.status_code == 200:
             print(dump_json(parse_recipe(r.text)))
     elif arguments.get('recipes', False):
@@ -172,7 +277,10 @@ def main():
         for x in get_categories(arguments['<url>']):
             print(x)
     elif arguments.get('scrape', False):
-        scrape()
+        scrape(int(arguments['--workers']),
+               arguments['--sink'],
+               arguments['--refresh'],
+               arguments['--bloom'])
 
 
 if __name__ == '__main__':
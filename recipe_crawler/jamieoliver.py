@@ -14,96 +14,192 @@ Usage:
     jamieoliver recipe <url>
     jamieoliver cat <url>
     jamieoliver categories
-    jamieoliver crawl
-    jamieoliver process <url>
+    jamieoliver crawl [--sink=SINK] [--refresh] [--bloom] [--workers=N]
+    jamieoliver process <url> [--sink=SINK]
+
+Options:
+    --sink=SINK  Where recipes are stored, one of files, jsonl or sqlite
+                 [default: files]
+    --refresh    List the categories again to discover new recipes
+    --bloom      Remember seen links in a bloom filter instead of a set
+    --workers=N  Number of pages fetched and parsed in parallel [default: 8]
 '''
 
 import bs4
+import concurrent.futures
+from dataclasses import dataclass
 import docopt
-import functools
-import json
-import multiprocessing
-import pathlib as pl
-import requests
+import threading
+from typing import List, NamedTuple, Optional
 import urllib.parse
 
-BASE_URL = 'http://www.jamieoliver.com'
+from crawler_common import (
+    crawl_state,
+    extract,
+    http_cache,
+    json_ld,
+    pagination,
+    retry,
+    schema,
+    work_queue,
+)
+from recipe_crawler import crawler, sinks
 
-dump_json = functools.partial(json.dumps,
-                              indent=4,
-                              ensure_ascii=False,
-                              sort_keys=True)
+BASE_URL = 'http://www.jamieoliver.com'
+PAGINATION = pagination.Pagination(first=1)
 
 
 def download_page(url, base=""):
     url = base + url
-    r = requests.get(url)
+    r = retry.DEFAULT_POLICY.call(url, http_cache.get, url)
     if r.status_code != 200:
         return ''
     r.encoding = 'utf-8'
     return r.text
 
 
-def parse_recipe(page):
-    soup = bs4.BeautifulSoup(page)
-    content = soup.find('div', {'class': 'tab-content'})
-    try:
-        desc_yield = content.find('span', {'class': 'description yield'}).text
-    except AttributeError:
-        desc_yield = ''
+def parse_json_ld_recipe(page):
+    recipe = json_ld.find(page, 'Recipe')
+    if recipe is None:
+        return None
+    instructions = json_ld.text(recipe.get('recipeInstructions'))
+    if not instructions:
+        return None
+    desc_yield = json_ld.texts(recipe.get('recipeYield'))
+    return {'instructions': instructions,
+            'desc_yield': desc_yield[0] if desc_yield else '',
+            'ingredients': json_ld.texts(recipe.get('recipeIngredient'))}
 
-    ingredients_list = [x.text for x in content.find_all(
-        'span', {'class': ''})]
-    instructions = content.find('p', {'class', 'instructions'}).text
-    return {'instructions': instructions, 'desc_yield': desc_yield,
-            'ingredients': ingredients_list}
 
+parse_dom_recipe = schema.Schema(
+    ('div', {'class': 'tab-content'}),
+    instructions=schema.Field(('p', {'class': 'instructions'})),
+    desc_yield=schema.Field(('span', {'class': 'description yield'}),
+                            default=''),
+    ingredients=schema.Field(('span', {'class': ''}), many=True),
+)
 
-def parse_recipe_list(page):
-    soup = bs4.BeautifulSoup(page)
+parse_recipe = extract.Extractor(parse_json_ld_recipe, parse_dom_recipe)
+
+
+def absolute_links(hrefs):
+    return [prepend_base_url(BASE_URL, x) for x in hrefs]
+
+
+def _recipe_links(soup):
     section = soup.find('section', {'id': 'recipe_filtered'})
     if section is None:
         return []
-    a_list = [x.a['href'] for x in section.find_all('h3')]
-    link_list = map(functools.partial(prepend_base_url, BASE_URL),
-                    a_list)
-    return link_list
+    return absolute_links(x.a['href'] for x in section.find_all('h3'))
+
+
+def _subcategory_links(soup):
+    # Only category overviews list their collections as subcategories
+    if soup.find('section', {'id': 'category_top'}) is None:
+        return []
+    section = soup.find('section', {'id': 'recipe_collections'})
+    if section is None:
+        return []
+    return absolute_links(x.a['href'] for x in section.find_all('article'))
+
+
+def parse_recipe_list(page):
+    return _recipe_links(bs4.BeautifulSoup(page))
+
+
+def get_recipes(url, max_workers=4):
+    """Recipe links of every page of a category, as they are parsed"""
+    return pagination.iter_listing(url,
+                                   download_page,
+                                   parse_recipe_list,
+                                   PAGINATION,
+                                   max_workers)
+
+
+class CategoryPage(NamedTuple):
+    url: str
+    subcategories: List[str]
+    recipes: List[str]
+    # The other pages of the listing, read from the pager
+    pages: List[str]
+    # content_hash of the page, None if it couldn't be downloaded
+    digest: Optional[str]
+
+
+def parse_category_page(url, page):
+    soup = bs4.BeautifulSoup(page)
+    return CategoryPage(url,
+                        _subcategory_links(soup),
+                        _recipe_links(soup),
+                        PAGINATION.remaining(url, page),
+                        crawl_state.content_hash(page or None))
+
+
+def fetch_category_page(url):
+    return parse_category_page(url, download_page(url))
 
 
-def process_recipe(url):
+class CategoryPages:
+    """Category pages of one crawl, each fetched and parsed at most once
+
+    Safe to share between threads, a page requested while it's being
+    fetched waits for that fetch instead of starting another one.
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            future = self._pages.get(url)
+            fetch = future is None
+            if fetch:
+                future = self._pages[url] = concurrent.futures.Future()
+        if fetch:
+            try:
+                future.set_result(fetch_category_page(url))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def recipe_key(url):
     parsed_url = urllib.parse.urlparse(url)
     path = parsed_url.path.split('/')
     name = path[-1]
     recipe_type = path[-2]
-    filepath = pl.Path('dump/{}/{}.json'.format(recipe_type, name))
-    if filepath.is_file():
-        return 'ExistsError'
+    return '{}/{}.json'.format(recipe_type, name)
 
-    page = download_page(url)
+
+def fetch_recipe(url):
+    return parse_recipe_page(url, download_page(url))
+
+
+def parse_recipe_page(url, page):
     if page == '':
-        return 'PageEmptyError'
+        return None
     try:
-        recipe = parse_recipe(page)
+        return parse_recipe(page)
     except Exception as e:
         print(e)
         print(url)
         raise
 
-    try:
-        filepath.parent.mkdir(parents=True)
-    except FileExistsError:
-        if not filepath.parent.is_dir():
-            filepath.parent.unlink()
-            filepath.parent.mkdir(parents=True)
-
-    with filepath.open('w') as f:
-        f.write(dump_json(recipe))
 
-    return filepath
+def process_recipe(url, sink):
+    key = recipe_key(url)
+    if key in sink:
+        return 'ExistsError'
+    recipe = fetch_recipe(url)
+    if recipe is None:
+        return 'PageEmptyError'
+    sink.write(key, recipe)
+    return key
 
 
 def download_main_categories(url):
-    r = requests.get(url)
+    r = retry.DEFAULT_POLICY.call(url, http_cache.get, url)
     r.encoding = 'utf-8'
     soup = bs4.BeautifulSoup(r.text)
     categories_div = soup.find('div', {'class': 'cat_secondary'})
@@ -112,55 +208,83 @@ def download_main_categories(url):
     return link_list
 
 
-def download_categories(url):
-    categories = download_main_categories(url)
+def download_categories(url, pages=None):
+    """Yield the subcategories of every main category, then the latter"""
+    if pages is None:
+        pages = CategoryPages()
+    categories = absolute_links(download_main_categories(url))
     for x in categories:
-        page = download_page(x)
-        subcategories = detect_subcategories(page)
-        if subcategories is not None:
-            subcategories = parse_subcategories(subcategories)
-            subcategories = map(
-                functools.partial(prepend_base_url, BASE_URL),
-                subcategories)
-            for x in subcategories:
-                yield x
-    for x in categories:
-        yield x
+        yield from pages.get(x).subcategories
+    yield from categories
 
 
-def detect_subcategories(page):
-    soup = bs4.BeautifulSoup(page)
-    section = soup.find('section', {'id': 'category_top'})
-    if section is not None:
-        section = soup.find('section', {'id': 'recipe_collections'})
-    return section
+def crawl_categories(crawl, url):
+    crawl.follow('listing', absolute_links(download_main_categories(url)))
+    return None
 
 
-def parse_subcategories(section):
-    categories_articles = section.find_all('article')
-    link_list = [x.a['href'] for x in categories_articles]
-    return link_list
+def crawl_listing(crawl, url):
+    page = crawl.pages.get(url)
+    if page.digest is None:
+        raise IOError("PageEmptyError: {}".format(url))
+    crawl.follow('listing', page.subcategories)
+    crawl.follow('recipe', page.recipes)
+    crawl.follow('listing', page.pages)
+    return page.digest
 
 
-def retrieve_recipe_list(url):
+def crawl_recipe(crawl, url):
+    key = recipe_key(url)
+    # Recipes scraped before the crawl state existed are only in the sink
+    if key in crawl.sink:
+        print(key)
+        return None
     page = download_page(url)
-    recipes = parse_recipe_list(page)
-    return recipes
+    recipe = parse_recipe_page(url, page)
+    if recipe is None:
+        raise IOError("PageEmptyError: {}".format(url))
+    crawl.sink.write(key, recipe)
+    print(key)
+    return crawl_state.content_hash(page)
 
 
-def crawl_recipes():
-    categories = download_categories(BASE_URL)
-    recipes_map = map(retrieve_recipe_list, categories)
-    with multiprocessing.Pool(processes=6) as pool:
-        for x in pool.imap_unordered(process_recipe_list, recipes_map):
-            print(x)
+@dataclass
+class JamieOliverCrawl(crawler.Crawl):
+    pages: CategoryPages
+
+    stages = {
+        'categories': crawl_categories,
+        'listing': crawl_listing,
+        'recipe': crawl_recipe,
+    }
 
 
-def process_recipe_list(recipes):
-    ret = list()
-    for url in recipes:
-        ret.append(process_recipe(url))
-    return ret
+DISCOVERY_STAGES = ('categories', 'listing')
+
+
+def crawl_recipes(sink=sinks.SINK_FILES, refresh=False, workers=8,
+                  bloom=False):
+    """Crawl every category and scrape the recipes listed in them
+
+    Category listings and single recipes are tasks of one work queue, so
+    listings are fetched in parallel and a large category is spread over
+    all workers instead of being scraped by one of them.
+
+    The crawl state in dump.state.sqlite lets an interrupted crawl
+    continue where it stopped. With `refresh` the categories are
+    discovered and listed again, recipes that are done stay skipped.
+    `bloom` keeps the seen links in a bloom filter saved between runs,
+    for crawls too large for a set in memory.
+    """
+    with crawl_state.CrawlState('dump.state.sqlite') as state, \
+            sinks.open_sink(sink, 'dump') as output, \
+            work_queue.WorkQueue(workers) as queue, \
+            crawler.open_seen_set(state, bloom) as seen:
+        if refresh:
+            state.reset(DISCOVERY_STAGES)
+        crawl = JamieOliverCrawl(queue, state, output, seen, CategoryPages())
+        crawl.run('categories', [BASE_URL])
+        crawl.report()
 
 
 def prepend_base_url(base, url):
@@ -177,17 +301,18 @@ def main():
         recipe = parse_recipe(page)
         print(recipe)
     elif arguments.get('cat', False):
-        page = download_page(arguments['<url>'])
-        print(parse_subcategories(detect_subcategories(page)))
+        print(fetch_category_page(arguments['<url>']).subcategories)
     elif arguments.get('recipes', False):
-        page = download_page(arguments['<url>'])
-        recipes = parse_recipe_list(page)
-        for x in recipes:
+        for x in get_recipes(arguments['<url>']):
             print(x)
     elif arguments.get('crawl', False):
-        crawl_recipes()
+        crawl_recipes(arguments['--sink'],
+                      arguments['--refresh'],
+                      int(arguments['--workers']),
+                      arguments['--bloom'])
     elif arguments.get('process', False):
-        page = process_recipe(arguments['<url>'])
+        with sinks.open_sink(arguments['--sink'], 'dump') as sink:
+            page = process_recipe(arguments['<url>'], sink)
         print(page)
     else:
         categories = download_categories(BASE_URL)
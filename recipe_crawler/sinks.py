@@ -0,0 +1,280 @@
+# ----------------------------------------------------------------------------
+# "THE SCOTCH-WARE LICENSE" (Revision 42):
+# <don@0xbeef.org> wrote this file. As long as you retain this notice you
+# can do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a scotch whisky in return
+# Marco 'don' Kaulea
+# ----------------------------------------------------------------------------
+"""Output sinks for scraped recipes
+
+Every recipe is stored under a key, the relative path it had as a single
+JSON file. `FileSink` keeps writing one pretty printed file per recipe,
+`JsonLinesSink` appends to rotating gzip compressed JSON-Lines shards and
+`SqliteSink` stores recipes in a single SQLite table, committing in
+batches. All sinks are safe to share between threads.
+
+The sinks that buffer tell when a write is safely stored through
+`when_stored`, so a crawl only marks a page as done once its recipe
+survives an interruption.
+"""
+
+import functools
+import gzip
+import json
+import pathlib as pl
+import sqlite3
+import threading
+import zlib
+
+SINK_FILES = 'files'
+SINK_JSONL = 'jsonl'
+SINK_SQLITE = 'sqlite'
+
+dump_json = functools.partial(json.dumps,
+                              indent=4,
+                              ensure_ascii=False,
+                              sort_keys=True)
+
+dump_line = functools.partial(json.dumps,
+                              ensure_ascii=False,
+                              sort_keys=True,
+                              separators=(',', ':'))
+
+
+class Sink:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting = []
+
+    def __contains__(self, key):
+        raise NotImplementedError
+
+    def write(self, key, recipe):
+        raise NotImplementedError
+
+    def when_stored(self, callback):
+        """Call `callback()` once everything written so far is stored
+
+        Right away if nothing is buffered, otherwise after the next flush
+        or commit.
+        """
+        with self._lock:
+            if self._buffered():
+                self._waiting.append(callback)
+                return
+        callback()
+
+    def _buffered(self):
+        # Called with the lock held
+        return False
+
+    def _stored(self):
+        # Called with the lock held, after the buffer was stored. The
+        # callbacks are returned to be called once the lock is released.
+        waiting, self._waiting = self._waiting, []
+        return waiting
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FileSink(Sink):
+    """One pretty printed JSON file per recipe, `key` is its path"""
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = pl.Path(root)
+
+    def __contains__(self, key):
+        return (self.root / key).is_file()
+
+    def write(self, key, recipe):
+        file_path = self.root / key
+        with self._lock:
+            try:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+            except FileExistsError:
+                # A file is in the way of the directory
+                file_path.parent.unlink()
+                file_path.parent.mkdir(parents=True)
+        with file_path.open('w', encoding='utf-8') as f:
+            f.write(dump_json(recipe))
+
+
+class JsonLinesSink(Sink):
+    """Gzip compressed JSON-Lines shards of `shard_size` recipes each
+
+    Each line is an object with the `key` and the `recipe`. A new shard
+    is started for every run, the keys of the existing shards are read
+    once on open. Shards are flushed every `batch_size` recipes, so an
+    interrupted crawl loses at most one batch.
+    """
+
+    SHARD_PATTERN = 'recipes-*.jsonl.gz'
+
+    def __init__(self, root, shard_size=10000, batch_size=100):
+        super().__init__()
+        self.root = pl.Path(root)
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        self.root.mkdir(parents=True, exist_ok=True)
+        shards = sorted(self.root.glob(self.SHARD_PATTERN))
+        self._keys = set()
+        for shard in shards:
+            self._keys.update(self._read_keys(shard))
+        self._next_shard = len(shards)
+        self._shard = None
+        self._in_shard = 0
+        self._unflushed = 0
+
+    @staticmethod
+    def _read_keys(shard):
+        try:
+            with gzip.open(str(shard), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)['key']
+                    except ValueError:
+                        # Last line of an interrupted run
+                        return
+        except (EOFError, OSError, zlib.error):
+            return
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def write(self, key, recipe):
+        line = dump_line({'key': key, 'recipe': recipe})
+        stored = []
+        with self._lock:
+            if self._shard is None or self._in_shard >= self.shard_size:
+                stored = self._rotate()
+            self._shard.write(line)
+            self._shard.write('\n')
+            self._keys.add(key)
+            self._in_shard += 1
+            self._unflushed += 1
+            if self._unflushed >= self.batch_size:
+                stored += self._flush()
+        _call(stored)
+
+    def _buffered(self):
+        return self._unflushed > 0
+
+    def _flush(self):
+        self._shard.flush()
+        self._unflushed = 0
+        return self._stored()
+
+    def _rotate(self):
+        stored = []
+        if self._shard is not None:
+            self._shard.close()
+            stored = self._stored()
+        name = self.SHARD_PATTERN.replace(
+            '*', '{:05d}'.format(self._next_shard))
+        self._shard = gzip.open(str(self.root / name), 'wt', encoding='utf-8')
+        self._next_shard += 1
+        self._in_shard = 0
+        self._unflushed = 0
+        return stored
+
+    def flush(self):
+        with self._lock:
+            stored = self._flush() if self._shard is not None else []
+        _call(stored)
+
+    def close(self):
+        stored = []
+        with self._lock:
+            if self._shard is not None:
+                self._shard.close()
+                self._shard = None
+                self._unflushed = 0
+                stored = self._stored()
+        _call(stored)
+
+
+class SqliteSink(Sink):
+    """Recipes as JSON text in a SQLite table, committed in batches"""
+
+    def __init__(self, path, batch_size=500):
+        super().__init__()
+        self.path = pl.Path(path)
+        self.batch_size = batch_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS recipes ('
+            'key TEXT PRIMARY KEY, recipe TEXT NOT NULL)')
+        self._db.commit()
+        self._pending = {}
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._pending:
+                return True
+            row = self._db.execute(
+                'SELECT 1 FROM recipes WHERE key = ?', (key,)).fetchone()
+        return row is not None
+
+    def write(self, key, recipe):
+        stored = []
+        with self._lock:
+            self._pending[key] = dump_line(recipe)
+            if len(self._pending) >= self.batch_size:
+                stored = self._commit()
+        _call(stored)
+
+    def _buffered(self):
+        return bool(self._pending)
+
+    def _commit(self):
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO recipes (key, recipe) VALUES (?, ?)',
+                self._pending.items())
+        self._pending.clear()
+        return self._stored()
+
+    def flush(self):
+        stored = []
+        with self._lock:
+            if self._pending:
+                stored = self._commit()
+        _call(stored)
+
+    def close(self):
+        stored = []
+        with self._lock:
+            if self._pending:
+                stored = self._commit()
+            self._db.close()
+        _call(stored)
+
+
+def _call(callbacks):
+    for callback in callbacks:
+        callback()
+
+
+def open_sink(kind, root):
+    """Open the sink `kind` for the recipes of a crawler rooted at `root`"""
+    if kind == SINK_FILES:
+        return FileSink(root)
+    if kind == SINK_JSONL:
+        return JsonLinesSink(root)
+    if kind == SINK_SQLITE:
+        return SqliteSink('{}.sqlite'.format(root))
+    raise ValueError("Unknown sink: {}".format(kind))